@@ -1,13 +1,28 @@
-from flask import Flask, request, render_template_string
-import io, base64
-from encoding import generate_codewords
-from matrix import place_data_bits, initialise_matrix
-from masking import apply_mask, calculate_penalty
-from main import get_format_info_bits
-from PIL import Image, ImageDraw
+from flask import Flask, Response, request, jsonify
+from jinja2 import Environment
+from typing import NamedTuple
+from urllib.parse import urlencode
+import io, os
+import metrics
+from encoding import ECC_LEVELS, choose_version
+from matrix import QRMatrix
+from pipeline import STEPS, QRPipeline
+from slideshow import Slideshow
+from cache import MemoryCache, FileCache, cache_key
+from vector import hex_to_rgb, matrix_to_svg, matrix_to_pdf
 
 app = Flask(__name__)
 
+# rendered PNGs and masked matrices, set QR_CACHE_DIR to share a file-based cache between workers
+# (capped at 256 MB, least recently used entries are removed first)
+render_cache = FileCache(os.environ['QR_CACHE_DIR']) if 'QR_CACHE_DIR' in os.environ else MemoryCache()
+
+# stage timings and counters served on /metrics, set QR_METRICS=0 to turn recording off
+metrics.enable(os.environ.get('QR_METRICS', '1') != '0')
+
+# one pipeline per error correction level, shared by every request
+PIPELINES = {level: QRPipeline(level) for level in ECC_LEVELS}
+
 INDEX_HTML = """
 <!DOCTYPE html>
 <html lang="en">
@@ -43,6 +58,13 @@ INDEX_HTML = """
             <option value="square">Square</option>
             <option value="circle">Circle</option>
         </select>
+        <label for="ecc">Error Correction:</label>
+        <select id="ecc" name="ecc">
+            <option value="L">L (7%)</option>
+            <option value="M">M (15%)</option>
+            <option value="Q">Q (25%)</option>
+            <option value="H">H (30%)</option>
+        </select>
         <label for="pixel_size">Pixel Size:</label>
         <input type="number" id="pixel_size" name="pixel_size" value="10" min="1" max="100">
         <label><input type="checkbox" name="slideshow">Show step by step slideshow</label> 
@@ -51,41 +73,33 @@ INDEX_HTML = """
     {% if error %}
     <div class="error">{{ error }}</div>
     {% endif %}
-    {% if slideshow_images %}
+    {% if slideshow_urls %}
     <h2>Step by Step Slideshow:</h2>
     <div class="slideshow">
-        {% for img in slideshow_images %}
-            <img src="data:image/png;base64,{{ img }}" alt="Step {{ loop.index }}">
+        {% for step, url in slideshow_urls %}
+            <img src="{{ url }}" alt="Step {{ loop.index }}: {{ step }}" loading="lazy">
         {% endfor %}
     </div>
+    <p>Animation: <a href="{{ qr_url|replace('/qr.png', '/qr.gif', 1) }}">GIF</a> | <a href="{{ qr_url|replace('/qr.png', '/qr.apng', 1) }}">APNG</a></p>
     {% endif %}
-    {% if qr_img %}
+    {% if qr_url %}
     <h2>Generated QR Code:</h2>
-    <img src="data:image/png;base64,{{ qr_img }}" alt="QR Code">
+    <img src="{{ qr_url }}" alt="QR Code">
+    <p>Download: <a href="{{ qr_url }}">PNG</a> | <a href="{{ qr_url|replace('/qr.png', '/qr.svg', 1) }}">SVG</a> | <a href="{{ qr_url|replace('/qr.png', '/qr.pdf', 1) }}">PDF</a></p>
     {% endif %}
 </body>
 </html>
 """
 
+# autoescaped like render_template_string, but usable outside a Flask request so the
+# ASGI entry point and worker pools can render pages too
+INDEX_TEMPLATE = Environment(autoescape=True).from_string(INDEX_HTML)
+
 def matrix_to_png_bytes(matrix, pixel_size=10, border=4, foreground_color=(0, 0, 0), background_color=(255, 255, 255), shape='square'):
-    size = len(matrix)
-    img_size = (size + 2*border) * pixel_size
-    img = Image.new("RGB", (img_size, img_size), background_color)
-    draw = ImageDraw.Draw(img)
-    pixels = img.load()
-    for r in range(size):
-        for c in range(size):
-            if matrix[r][c] is None:
-                continue
-            fill = foreground_color if matrix[r][c] == 1 else background_color
-            x0 = (c + border) * pixel_size
-            y0 = (r + border) * pixel_size
-            x1 = x0 + pixel_size
-            y1 = y0 + pixel_size
-            if shape == 'circle':
-                draw.ellipse([x0, y0, x1, y1], fill=fill)
-            else:  # square
-                draw.rectangle([x0, y0, x1, y1], fill=fill)
+    # PIL is only loaded once the first PNG is rendered
+    from image_utils import render_image
+
+    img = render_image(matrix, pixel_size, border, foreground_color, background_color, shape)
     bio = io.BytesIO()
     img.save(bio, format="PNG")
     bio.seek(0)
@@ -93,86 +107,199 @@ def matrix_to_png_bytes(matrix, pixel_size=10, border=4, foreground_color=(0, 0,
     return bio
 
 
+# bumped whenever rendering changes, so old ETags stop matching
+RENDER_REVISION = 1
+CACHE_CONTROL = 'public, max-age=86400'
+
+def slideshow_to_animation_bytes(slideshow, fmt, *args):
+    bio = io.BytesIO()
+    slideshow.save_animation(bio, fmt, *args)
+
+    return bio.getvalue()
+
+
+# media type and renderer for each /qr.<format> endpoint, animations take a Slideshow
+IMAGE_FORMATS = {
+    'png': ('image/png', lambda *args: matrix_to_png_bytes(*args).getvalue()),
+    'svg': ('image/svg+xml', matrix_to_svg),
+    'pdf': ('application/pdf', matrix_to_pdf),
+    'gif': ('image/gif', lambda slideshow, *args: slideshow_to_animation_bytes(slideshow, 'gif', *args)),
+    'apng': ('image/apng', lambda slideshow, *args: slideshow_to_animation_bytes(slideshow, 'apng', *args)),
+}
+ANIMATION_FORMATS = ('gif', 'apng')
+
+
+# final masked matrix with format info for the text, reused from the cache when possible
+# cached entries are the packed QRMatrix bytes, wrapped again without copying
+def build_matrix(data, version, ecc='L'):
+    matrix_key = cache_key('qrmatrix', data, version, ecc)
+    packed = render_cache.get(matrix_key)
+    if packed is not None:
+        return QRMatrix.frombuffer(packed, version)
+
+    qr = PIPELINES[ecc].run(data, version).matrix
+    render_cache.set(matrix_key, qr.tobytes())
+
+    return qr
+
+
+# packed snapshot of every pipeline step, cached like build_matrix
+def build_slideshow(data, version, ecc='L'):
+    slideshow_key = cache_key('slideshow', data, version, ecc)
+    packed = render_cache.get(slideshow_key)
+    if packed is not None:
+        return Slideshow.frombuffer(packed, version)
+
+    slideshow, code = Slideshow.record(data, version, ecc)
+    render_cache.set(slideshow_key, slideshow.tobytes())
+    render_cache.set(cache_key('qrmatrix', data, version, ecc), code.matrix.tobytes())
+
+    return slideshow
+
+
+def render_page(**context):
+    return INDEX_TEMPLATE.render(**context)
+
+
+# result page for a submitted form (any mapping of field name to value)
+def generate_page(form):
+    data = form.get('text', '')
+    foreground = form.get('foreground_colour', '#000000')
+    background = form.get('background_colour', '#ffffff')
+    shape = form.get('shape', 'square')
+    pixel_size = int(form.get('pixel_size', 10))
+    ecc = form.get('ecc', 'L')
+    slideshow = 'slideshow' in form
+
+    # auto detect version based on input length
+    try:
+        choose_version(data, ecc)
+    except UnicodeEncodeError:
+        return render_page(error="Unsupported character in input.")
+    except ValueError as e:
+        return render_page(error=str(e))
+
+    # the page links to the image endpoint, which renders (or serves from cache) on fetch,
+    # slideshow steps are separate images of the same endpoint
+    qr_url = '/qr.png?' + urlencode({'text': data, 'fg': foreground.lstrip('#'), 'bg': background.lstrip('#'),
+                                     'shape': shape, 'pixel_size': pixel_size, 'ecc': ecc})
+    slideshow_urls = [(step, f'{qr_url}&step={i}') for i, step in enumerate(STEPS)] if slideshow else None
+
+    return render_page(qr_url=qr_url, slideshow_urls=slideshow_urls)
+
+
+# validated parameters of a /qr.<format> request
+class ImageRequest(NamedTuple):
+    fmt: str
+    data: str
+    version: int
+    ecc: str
+    fg: tuple
+    bg: tuple
+    shape: str
+    pixel_size: int
+    border: int
+    step: int | None = None
+
+    @property
+    def key(self):
+        return cache_key(*self)
+
+    # strong ETag derived from the inputs only, so it is known before anything is generated
+    @property
+    def etag(self):
+        return cache_key(self.key, RENDER_REVISION)
+
+
+# parse query arguments, raises ValueError with a message for the client
+def parse_image_request(fmt, args):
+    data = args.get('text')
+    if not data:
+        raise ValueError("Missing text parameter.")
+    shape = args.get('shape', 'square')
+    ecc = args.get('ecc', 'L')
+    if ecc not in ECC_LEVELS:
+        raise ValueError("Invalid ecc, must be L, M, Q or H.")
+    try:
+        fg = hex_to_rgb(args.get('fg', '000000'))
+        bg = hex_to_rgb(args.get('bg', 'ffffff'))
+        pixel_size = int(args.get('pixel_size', 10))
+        border = int(args.get('border', 4))
+        step = int(args['step']) if 'step' in args and fmt not in ANIMATION_FORMATS else None
+        version = choose_version(data, ecc)
+    except UnicodeEncodeError:
+        raise ValueError("Unsupported character in input.")
+    if shape not in ('square', 'circle') or not 1 <= pixel_size <= 100 or not 0 <= border <= 20:
+        raise ValueError("Invalid shape, pixel_size (1-100) or border (0-20).")
+    if step is not None and not 0 <= step < len(STEPS):
+        raise ValueError(f"Invalid step, must be 0-{len(STEPS) - 1}.")
+
+    return ImageRequest(fmt, data, version, ecc, fg, bg, shape, pixel_size, border, step)
+
+
+# encode, mask and render the requested image (a slideshow step or animation when asked
+# for), no output caching
+def render_image_request(req):
+    render = IMAGE_FORMATS[req.fmt][1]
+    if req.fmt in ANIMATION_FORMATS:
+        source = build_slideshow(req.data, req.version, req.ecc)
+    elif req.step is not None:
+        source = build_slideshow(req.data, req.version, req.ecc).frames[req.step]
+    else:
+        source = build_matrix(req.data, req.version, req.ecc)
+    with metrics.stage(f'render_{req.fmt}'):
+        body = render(source, req.pixel_size, req.border, req.fg, req.bg, req.shape)
+    metrics.IMAGES_RENDERED.inc(format=req.fmt, shape=req.shape)
+
+    return body
+
+
 @app.route('/', methods=['GET'])
 def index():
-    return render_template_string(INDEX_HTML)
+    return render_page()
 
 
 @app.route('/generate', methods=['POST'])
 def generate():
-    data = request.form.get('text', '')
-    foreground = request.form.get('foreground_colour', '#000000')
-    background = request.form.get('background_colour', '#ffffff')
-    shape = request.form.get('shape', 'square')
-    pixel_size = int(request.form.get('pixel_size', 10))
-    slideshow = 'slideshow' in request.form
-
-    # Version 1-L capacity is 19 bytes
+    return generate_page(request.form)
+
+
+# raw image bytes for GET /qr.png?text=...&fg=000000&bg=ffffff&shape=square&pixel_size=10&ecc=L
+# step=0-3 gives that slideshow step instead, /qr.gif and /qr.apng animate every step
+# a matching If-None-Match is answered with 304 before anything is generated
+@app.route('/qr.<fmt>', methods=['GET'])
+def qr_image(fmt):
+    if fmt not in IMAGE_FORMATS:
+        return "Unsupported format.", 404
     try:
-        raw = data.encode('iso-8859-1', 'strict')
-    except UnicodeEncodeError:
-        return render_template_string(INDEX_HTML, qr_img=None, error="Unsupported character in input.")
-    
-    # auto detect version based on input length
-    if len(raw) <= 19:
-        version = 1
-    elif len(raw) <= 34:
-        version = 2
+        req = parse_image_request(fmt, request.args)
+    except ValueError as e:
+        return str(e), 400
+
+    if request.if_none_match.contains_weak(req.etag):
+        response = Response(status=304)
     else:
-        return render_template_string(INDEX_HTML, qr_img=None, error="Input too long (max 34 bytes for version 2).")
-    
-    # generate codewords
-    data_cw, ecc_cw = generate_codewords(data, version)
-    data_bits = ''.join(format(b, '08b') for b in data_cw)
-    ecc_bits = ''.join(format(b, '08b') for b in ecc_cw)
-
-    # build initial matrix and record steps
-    matrix, reserved = initialise_matrix(version)
-    steps = []
-    if slideshow:
-        # step 1: just patterns
-        img1 = matrix_to_png_bytes(matrix, pixel_size, 4, tuple(int(foreground.lstrip('#')[i:i+2],16) for i in (0,2,4)), tuple(int(background.lstrip('#')[i:i+2],16) for i in (0,2,4)), shape)
-        steps.append(base64.b64encode(img1.getvalue()).decode('ascii'))
-
-    # step 2: place data bits
-    place_data_bits(matrix, reserved, data_bits + ecc_bits)
-    if slideshow:
-        img2 = matrix_to_png_bytes(matrix, pixel_size, 4, tuple(int(foreground.lstrip('#')[i:i+2],16) for i in (0,2,4)), tuple(int(background.lstrip('#')[i:i+2],16) for i in (0,2,4)), shape)
-        steps.append(base64.b64encode(img2.getvalue()).decode('ascii'))
-
-    # step 3: choose best mask
-    best_mask, best_matrix, _ = min(
-        ((mask, apply_mask(matrix, reserved, mask), calculate_penalty(apply_mask(matrix, reserved, mask)))
-         for mask in range(8)), key=lambda x: x[2]
-    )
-    if slideshow:
-        img3 = matrix_to_png_bytes(best_matrix, pixel_size, 4, tuple(int(foreground.lstrip('#')[i:i+2],16) for i in (0,2,4)), tuple(int(background.lstrip('#')[i:i+2],16) for i in (0,2,4)), shape)
-        steps.append(base64.b64encode(img3.getvalue()).decode('ascii'))
-
-    # step 4: place format info bits
-    format_bits = get_format_info_bits('L', best_mask)
-    fmt_positions = [(8, i) for i in range(6)] + [(8,7), (8,8), (7,8)] + [(i,8) for i in range(5, -1, -1)]
-    for idx, (r, c) in enumerate(fmt_positions):
-        best_matrix[r][c] = int(format_bits[idx])
-    if slideshow:
-        img4 = matrix_to_png_bytes(best_matrix, pixel_size, 4, tuple(int(foreground.lstrip('#')[i:i+2],16) for i in (0,2,4)), tuple(int(background.lstrip('#')[i:i+2],16) for i in (0,2,4)), shape)
-        steps.append(base64.b64encode(img4.getvalue()).decode('ascii'))
-
-    # second copy of format info (bottom-left & top-right)
-    size = len(best_matrix)
-    sec_fmt_positions = (
-        [(size-1 - i, 8) for i in range(7)]
-        + [(8, size-8)]
-        + [(8, size-7 + i) for i in range(7)]
-    )
-    for idx, (r, c) in enumerate(sec_fmt_positions):
-        best_matrix[r][c] = int(format_bits[idx])
-
-    # render image
-    img_bytes = matrix_to_png_bytes(best_matrix, pixel_size, 4, tuple(int(foreground.lstrip('#')[i:i+2],16) for i in (0,2,4)), tuple(int(background.lstrip('#')[i:i+2],16) for i in (0,2,4)), shape)
-    qr_img = base64.b64encode(img_bytes.getvalue()).decode('ascii')
-
-    return render_template_string(INDEX_HTML, qr_img=qr_img, slideshow_images=steps if slideshow else None)
+        body = render_cache.get(req.key)
+        if body is None:
+            body = render_image_request(req)
+            render_cache.set(req.key, body)
+        response = Response(body, mimetype=IMAGE_FORMATS[fmt][0])
+    response.set_etag(req.etag)
+    response.headers['Cache-Control'] = CACHE_CONTROL
+
+    return response
+
+
+# hit, miss and eviction counters of the render cache
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    return jsonify(render_cache.stats())
+
+
+# stage latency histograms and generation counters in the Prometheus text format
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.render_prometheus(), content_type=metrics.CONTENT_TYPE)
 
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,145 @@
+# ASGI entry point
+#
+# Request handling stays on the event loop while encoding, masking and rendering run on a
+# bounded worker pool. Once max_pending jobs are queued or running, new work is refused
+# with 503 and a Retry-After header instead of queueing behind slow generations.
+#
+# Usage:
+#   uvicorn asgi:app
+#
+# Environment:
+#   QR_WORKERS: pool size, default is the number of CPUs
+#   QR_MAX_PENDING: jobs queued or running before 503, default is 4 per worker
+#   QR_POOL: 'thread' (default) or 'process', stage metrics recorded inside worker
+#            processes are not seen by /metrics
+
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from urllib.parse import parse_qsl
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import HTMLResponse, JSONResponse, PlainTextResponse, Response
+from starlette.routing import Route
+
+import metrics
+from app import (CACHE_CONTROL, IMAGE_FORMATS, generate_page, parse_image_request,
+                 render_cache, render_image_request, render_page)
+from cache import MemoryCache
+
+RETRY_AFTER_SECONDS = 1
+
+
+class PoolSaturated(Exception):
+    pass
+
+
+# executor wrapper that counts queued and running jobs and refuses work past max_pending
+# the counter is only touched on the event loop thread, so it needs no lock
+class GenerationPool:
+
+    def __init__(self, executor: Executor, max_pending: int):
+        self.executor = executor
+        self.max_pending = max_pending
+        self.pending = 0
+
+    async def run(self, fn, *args):
+        if self.pending >= self.max_pending:
+            raise PoolSaturated()
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+        finally:
+            self.pending -= 1
+
+
+def _busy() -> Response:
+    return PlainTextResponse("Server busy, retry shortly.", status_code=503,
+                             headers={'Retry-After': str(RETRY_AFTER_SECONDS)})
+
+
+# cache reads and writes, off the event loop unless the backend is the in-process MemoryCache
+# (FileCache does blocking file I/O and rescans its directory when it evicts)
+async def _cache_call(fn, *args):
+    if isinstance(render_cache, MemoryCache):
+        return fn(*args)
+
+    return await asyncio.to_thread(fn, *args)
+
+
+# If-None-Match holds a comma separated list of (possibly weak) ETags or '*'
+def _etag_matches(header: str | None, etag: str) -> bool:
+    if not header:
+        return False
+    tags = [tag.strip().removeprefix('W/') for tag in header.split(',')]
+
+    return '*' in tags or f'"{etag}"' in tags
+
+
+def create_app(workers: int | None = None, max_pending: int | None = None, processes: bool = False) -> Starlette:
+    workers = workers or os.cpu_count() or 1
+    executor = ProcessPoolExecutor(workers) if processes else ThreadPoolExecutor(workers)
+    pool = GenerationPool(executor, max_pending or 4 * workers)
+
+    async def index(request: Request) -> Response:
+        return HTMLResponse(render_page())
+
+    async def generate(request: Request) -> Response:
+        form = dict(parse_qsl((await request.body()).decode('utf-8'), keep_blank_values=True))
+        try:
+            return HTMLResponse(await pool.run(generate_page, form))
+        except PoolSaturated:
+            return _busy()
+
+    async def qr_image(request: Request) -> Response:
+        fmt = request.path_params['fmt']
+        if fmt not in IMAGE_FORMATS:
+            return PlainTextResponse("Unsupported format.", status_code=404)
+        try:
+            req = parse_image_request(fmt, request.query_params)
+        except ValueError as e:
+            return PlainTextResponse(str(e), status_code=400)
+
+        headers = {'ETag': f'"{req.etag}"', 'Cache-Control': CACHE_CONTROL}
+        if _etag_matches(request.headers.get('if-none-match'), req.etag):
+            return Response(status_code=304, headers=headers)
+        body = await _cache_call(render_cache.get, req.key)
+        if body is None:
+            try:
+                body = await pool.run(render_image_request, req)
+            except PoolSaturated:
+                return _busy()
+            await _cache_call(render_cache.set, req.key, body)
+
+        return Response(body, media_type=IMAGE_FORMATS[fmt][0], headers=headers)
+
+    async def cache_stats(request: Request) -> Response:
+        return JSONResponse(render_cache.stats())
+
+    async def metrics_endpoint(request: Request) -> Response:
+        return Response(metrics.render_prometheus(), headers={'Content-Type': metrics.CONTENT_TYPE})
+
+    @asynccontextmanager
+    async def lifespan(app: Starlette):
+        yield
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    starlette_app = Starlette(routes=[
+        Route('/', index, methods=['GET']),
+        Route('/generate', generate, methods=['POST']),
+        Route('/qr.{fmt}', qr_image, methods=['GET']),
+        Route('/cache/stats', cache_stats, methods=['GET']),
+        Route('/metrics', metrics_endpoint, methods=['GET']),
+    ], lifespan=lifespan)
+    starlette_app.state.pool = pool
+
+    return starlette_app
+
+
+app = create_app(
+    workers=int(os.environ.get('QR_WORKERS', 0)) or None,
+    max_pending=int(os.environ.get('QR_MAX_PENDING', 0)) or None,
+    processes=os.environ.get('QR_POOL', 'thread') == 'process',
+)
@@ -0,0 +1,266 @@
+# Bulk QR code generation
+#
+# Inputs are streamed in chunks, grouped by version and run through encoding, placement
+# and masking as whole (batch, size, size) arrays. Chunks can be spread over a pool of
+# worker processes, results still come back in input order and only a bounded number
+# of chunks are in flight at a time. With verify=True every code is decoded again and
+# one that does not read back as its input is reported as an error.
+#
+# Usage:
+#   for result in generate_many(texts, workers=8):
+#       ...
+#   write_batch("input.jsonl", "out/", workers=8)
+#   store_batch("input.jsonl", "run.qrm", workers=8)
+
+import csv
+import itertools
+import json
+import os
+from collections import defaultdict, deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Callable, Iterable, Iterator, NamedTuple
+
+import numpy as np
+
+from decode import DecodeError, decode_many
+from encoding import (ECC_CODEWORDS_PER_BLOCK, MAX_VERSION, MIN_VERSION, choose_version,
+                      encode_data_codewords, interleave_codewords)
+from format_info import FORMAT_BITS
+from matrix import QRMatrix, get_template, get_placement_index, place_codewords, place_format_bits
+from masking import apply_masks, best_masks, get_mask_grids, get_penalty_plan
+from pipeline import QRCode
+from reed_solomon import _generator_rows
+from store import MatrixStore
+
+DEFAULT_CHUNK_SIZE = 256
+
+# one generated code, matrix is None and error is set when the input could not be encoded
+class BatchResult(NamedTuple):
+    index: int
+    text: str
+    version: int | None
+    mask: int | None
+    matrix: np.ndarray | None
+    error: str | None = None
+
+
+# split an iterable into (chunk, start index) pairs of at most size items without reading ahead
+def _chunks(items: Iterable, size: int) -> Iterator[tuple[list, int]]:
+    iterator = iter(items)
+    start = 0
+    while chunk := list(itertools.islice(iterator, size)):
+        yield chunk, start
+        start += len(chunk)
+
+
+# build the RS tables for every level and the per-version templates, placement indices,
+# mask grids and penalty plans of the versions most inputs need, once per worker
+def _warm_worker(max_version: int = 10) -> None:
+    for ecc_count in {n for counts in ECC_CODEWORDS_PER_BLOCK.values() for n in counts[MIN_VERSION:]}:
+        _generator_rows(ecc_count)
+    for version in range(MIN_VERSION, min(max_version, MAX_VERSION) + 1):
+        template, _ = get_template(version)
+        get_placement_index(version)
+        get_mask_grids(template.shape[-1])
+        get_penalty_plan(version)
+
+
+# map fn over argument tuples on an executor, yielding results in submission order
+# with at most max_pending calls in flight so memory stays flat
+def _ordered_map(executor: Executor, fn, arguments: Iterable[tuple], max_pending: int) -> Iterator:
+    pending = deque()
+    for args in arguments:
+        pending.append(executor.submit(fn, *args))
+        if len(pending) >= max_pending:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def _check_workers(workers: int) -> None:
+    if workers < 0:
+        raise ValueError(f"Invalid number of workers {workers}, must be 0 or more")
+
+
+# run fn over every chunk, in this process when workers is 1, otherwise on a warmed pool
+# workers is checked when this is called rather than on the first chunk
+def _run_chunks(fn, arguments: Iterable[tuple], workers: int) -> Iterator:
+    _check_workers(workers)
+    if workers == 1:
+        return (fn(*args) for args in arguments)
+
+    return _pool_chunks(fn, arguments, workers or os.cpu_count() or 1)
+
+
+def _pool_chunks(fn, arguments: Iterable[tuple], workers: int) -> Iterator:
+    with ProcessPoolExecutor(workers, initializer=_warm_worker) as executor:
+        yield from _ordered_map(executor, fn, arguments, 2 * workers)
+
+
+# run every code of one version and ECC level through the pipeline together
+def _generate_group(texts: list[str], version: int, ecc: str = 'L') -> tuple[np.ndarray, np.ndarray]:
+    data = np.array([np.frombuffer(encode_data_codewords(t, version, ecc), dtype=np.uint8) for t in texts])
+    codewords = interleave_codewords(data, version, ecc)
+
+    template, reserved = get_template(version)
+    matrices = np.repeat(template[None], len(texts), axis=0)
+    place_codewords(matrices, codewords)
+
+    candidates = apply_masks(matrices, reserved)
+    masks = best_masks(candidates)
+    best = candidates[np.arange(len(texts)), masks]
+    place_format_bits(best, FORMAT_BITS[ecc][masks])
+
+    return masks, best
+
+
+# why a generated matrix does not decode back to its text, or None when it does
+def _verification_error(decoded, text: str, mask: int) -> str | None:
+    if isinstance(decoded, DecodeError):
+        return f"Verification failed: {decoded}"
+    if decoded.text != text or decoded.mask != mask:
+        return "Verification failed: decoded text or mask differs from the input"
+
+    return None
+
+
+# with verify, every matrix is decoded again and a mismatch is reported as an error
+def _generate_chunk(texts: list[str], start: int, ecc: str = 'L', verify: bool = False) -> list[BatchResult]:
+    results = [None] * len(texts)
+    groups = defaultdict(list)
+    for i, text in enumerate(texts):
+        try:
+            groups[choose_version(text, ecc)].append(i)
+        except (ValueError, UnicodeEncodeError) as e:
+            results[i] = BatchResult(start + i, text, None, None, None, str(e))
+
+    for version, indices in groups.items():
+        masks, matrices = _generate_group([texts[i] for i in indices], version, ecc)
+        decoded = decode_many(matrices) if verify else None
+        for j, i in enumerate(indices):
+            error = _verification_error(decoded[j], texts[i], int(masks[j])) if verify else None
+            if error is None:
+                results[i] = BatchResult(start + i, texts[i], version, int(masks[j]), matrices[j])
+            else:
+                results[i] = BatchResult(start + i, texts[i], version, int(masks[j]), None, error)
+
+    return results
+
+
+# generate a QR matrix for every text, streamed in input order
+# workers is the number of processes, 1 runs in this process and 0 uses every core
+def generate_many(texts: Iterable[str], chunk_size: int = DEFAULT_CHUNK_SIZE,
+                  workers: int = 1, ecc: str = 'L', verify: bool = False) -> Iterator[BatchResult]:
+    arguments = ((chunk, start, ecc, verify) for chunk, start in _chunks(texts, chunk_size))
+
+    return itertools.chain.from_iterable(_run_chunks(_generate_chunk, arguments, workers))
+
+
+# read (name, text) records from a .txt, .csv or .jsonl file one at a time
+# csv uses the 'text' column if there is a header with one (else the first column) and
+# an optional 'name' column, jsonl lines are strings or objects with 'text' and 'name'
+def read_records(path: str) -> Iterator[tuple[str | None, str]]:
+    ext = os.path.splitext(path)[1].lower()
+    with open(path, newline='', encoding='utf-8') as f:
+        if ext == '.csv':
+            reader = csv.reader(f)
+            header = next(reader, None)
+            if header is None:
+                return
+            if 'text' in header:
+                text_col = header.index('text')
+                name_col = header.index('name') if 'name' in header else None
+            else:
+                text_col, name_col = 0, None
+                yield None, header[0]
+            for row in reader:
+                if row:
+                    yield (row[name_col] if name_col is not None else None), row[text_col]
+        elif ext == '.jsonl':
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if isinstance(record, str):
+                    yield None, record
+                else:
+                    yield record.get('name'), record['text']
+        else:
+            for line in f:
+                yield None, line.rstrip('\r\n')
+
+
+# generate and save one chunk of (name, text) records, returns (index, error) per record
+def _write_chunk(records: list[tuple[str | None, str]], start: int, out_dir: str,
+                 pixel_size: int, ecc: str = 'L', verify: bool = False) -> list[tuple[int, str | None]]:
+    from image_utils import save_matrix_as_image
+
+    outcomes = []
+    for (name, _), result in zip(records, _generate_chunk([text for _, text in records], start, ecc, verify)):
+        if result.error is None:
+            name = os.path.basename(name) if name else f"{result.index:06d}"
+            if not name.lower().endswith('.png'):
+                name += '.png'
+            save_matrix_as_image(result.matrix, os.path.join(out_dir, name), pixel_size, show=False)
+        outcomes.append((result.index, result.error))
+
+    return outcomes
+
+
+# generate codes for every record in path and write them to out_dir as they are produced
+# returns (written, failed) counts, with verify a code that does not decode back counts as failed
+# on_skip(index, error) is called for every record that failed, as it happens
+def write_batch(path: str, out_dir: str, pixel_size: int = 10, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                workers: int = 1, ecc: str = 'L', verify: bool = False,
+                on_skip: Callable[[int, str], None] | None = None) -> tuple[int, int]:
+    arguments = ((chunk, start, out_dir, pixel_size, ecc, verify)
+                 for chunk, start in _chunks(read_records(path), chunk_size))
+    chunks = _run_chunks(_write_chunk, arguments, workers)
+    os.makedirs(out_dir, exist_ok=True)
+    written = failed = 0
+    for outcomes in chunks:
+        for index, error in outcomes:
+            if error is not None:
+                if on_skip is not None:
+                    on_skip(index, error)
+                failed += 1
+            else:
+                written += 1
+
+    return written, failed
+
+
+# generate codes for every record in path and append them to the MatrixStore at store_path,
+# one write per chunk, records already in the store are not generated again
+# returns (written, failed) counts and calls on_skip like write_batch
+def store_batch(path: str, store_path: str, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                workers: int = 1, ecc: str = 'L', verify: bool = False,
+                on_skip: Callable[[int, str], None] | None = None) -> tuple[int, int]:
+    _check_workers(workers)
+    written = failed = 0
+    with MatrixStore(store_path, 'a') as store:
+        # record numbers of the texts handed out, results come back in the same order
+        pending = deque()
+
+        def new_texts() -> Iterator[str]:
+            for index, (_, text) in enumerate(read_records(path)):
+                if (text, ecc) not in store:
+                    pending.append(index)
+                    yield text
+
+        added = []
+        for result in generate_many(new_texts(), chunk_size, workers, ecc, verify):
+            index = pending.popleft()
+            if result.error is not None:
+                if on_skip is not None:
+                    on_skip(index, result.error)
+                failed += 1
+                continue
+            code = QRCode(result.version, ecc, result.mask, QRMatrix.from_array(result.matrix, result.version))
+            added.append((result.text, code))
+            if len(added) == chunk_size:
+                written += store.extend(added)
+                added = []
+        written += store.extend(added)
+
+    return written, failed
@@ -0,0 +1,83 @@
+# Decoding generated codes, one at a time and as a batch, against generating them
+#
+# Every version and ECC level is first round tripped on random mixed mode text (decode
+# must return the input, version, level and mask, and reject the code once a finder,
+# timing or alignment module is flipped), then decoding is timed per code next to batch
+# generation so the cost of verify=True is visible.
+#
+# Usage:
+#   python -m benchmarks.bench_decode
+
+import random
+import timeit
+
+from batch import _generate_group
+from decode import DecodeError, decode, decode_many
+from encoding import ECC_LEVELS, choose_version
+from pipeline import QRPipeline
+
+VERSIONS = [1, 5, 10, 25, 40]
+BATCH = 64
+CHARACTERS = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ $%*+-./:abcdefghé日本語'
+
+
+# random mixed mode text that needs exactly the given version at the given level
+def text_for(version: int, ecc: str, rng: random.Random) -> str:
+    text = ''
+    while True:
+        longer = text + ''.join(rng.choice(CHARACTERS) for _ in range(version))
+        try:
+            if choose_version(longer, ecc) > version:
+                break
+        except ValueError:
+            break
+        text = longer
+
+    return text or rng.choice(CHARACTERS)
+
+
+def check(rng: random.Random) -> int:
+    checked = 0
+    for version in range(1, 41):
+        for ecc in ECC_LEVELS:
+            text = text_for(version, ecc, rng)
+            code = QRPipeline(ecc).run(text, version)
+            decoded = decode(code.matrix)
+            if (decoded.text, decoded.version, decoded.ecc, decoded.mask) != (text, version, ecc, code.mask):
+                raise AssertionError(f"decode does not round trip at version {version}-{ecc}")
+            # top left finder, vertical timing and, from version 2, the last alignment centre
+            size = code.matrix.size
+            for r, c in [(3, 3), (size - 9, 6)] + ([(size - 7, size - 7)] if version > 1 else []):
+                damaged = code.matrix.to_array()
+                damaged[r, c] ^= 1
+                try:
+                    decode(damaged)
+                except DecodeError:
+                    continue
+                raise AssertionError(f"decode accepts a damaged function pattern at version {version}-{ecc}")
+            checked += 1
+
+    return checked
+
+
+def bench(version: int, rng: random.Random, number: int = 3) -> dict[str, float]:
+    texts = [text_for(version, 'M', rng) for _ in range(BATCH)]
+    _, matrices = _generate_group(texts, version, 'M')
+
+    def millis(fn, count: int = 1) -> float:
+        return min(timeit.repeat(fn, number=number, repeat=3)) / number / count * 1e3
+
+    return {
+        "decode (single)": millis(lambda: decode(matrices[0])),
+        f"decode_many (batch of {BATCH})": millis(lambda: decode_many(matrices), BATCH),
+        f"generate (batch of {BATCH})": millis(lambda: _generate_group(texts, version, 'M'), BATCH),
+    }
+
+
+if __name__ == "__main__":
+    rng = random.Random(0)
+    print(f"decode round trips {check(rng)} codes")
+    for version in VERSIONS:
+        print(f"version {version}-M, milliseconds per code:")
+        for name, millis in bench(version, rng).items():
+            print(f"  {name:28s} {millis:8.3f}")
@@ -0,0 +1,74 @@
+# Mask selection: exhaustive scoring of all 8 candidates against best_masks
+#
+# best_masks must pick the same mask as calculate_penalties(...).argmin() for every input,
+# which is checked on random matrices of every version, with and without format
+# information in place, before anything is timed.
+#
+# Usage:
+#   python -m benchmarks.bench_masking
+
+import timeit
+
+import numpy as np
+
+import masking
+from masking import apply_masks, best_masks, calculate_penalties
+from matrix import get_template
+
+VERSIONS = [1, 5, 10, 25, 40]
+BATCH = 64
+CHECKS = 16
+
+
+# random data modules on the version template, dark with probability density
+def random_candidates(version: int, count: int, rng: np.random.Generator, density: float = 0.5,
+                      ecc: str | None = None) -> np.ndarray:
+    template, reserved = get_template(version)
+    matrices = np.repeat(template[None], count, axis=0)
+    matrices[:, ~reserved] = rng.random((count, int((~reserved).sum()))) < density
+
+    return apply_masks(matrices, reserved, ecc)
+
+
+# same pick as the exhaustive search, with and without early exit
+def check(rng: np.random.Generator) -> int:
+    checked = 0
+    threshold = masking.EARLY_EXIT_MODULES
+    try:
+        for early_exit in (0, threshold):
+            masking.EARLY_EXIT_MODULES = early_exit
+            for version in range(1, 41):
+                for density, ecc in ((0.1, None), (0.5, None), (0.9, None), (0.5, 'M')):
+                    candidates = random_candidates(version, CHECKS, rng, density, ecc)
+                    expected = calculate_penalties(candidates).argmin(axis=-1)
+                    if not np.array_equal(best_masks(candidates), expected):
+                        raise AssertionError(f"best_masks differs from exhaustive search at version {version}")
+                    checked += CHECKS
+    finally:
+        masking.EARLY_EXIT_MODULES = threshold
+
+    return checked
+
+
+def bench(version: int, rng: np.random.Generator, number: int = 3) -> dict[str, float]:
+    single = random_candidates(version, 1, rng)[0]
+    batch = random_candidates(version, BATCH, rng)
+
+    def millis(fn, count: int = 1) -> float:
+        return min(timeit.repeat(fn, number=number, repeat=3)) / number / count * 1e3
+
+    return {
+        "exhaustive (single)": millis(lambda: calculate_penalties(single).argmin()),
+        "best_masks (single)": millis(lambda: best_masks(single)),
+        f"exhaustive (batch of {BATCH})": millis(lambda: calculate_penalties(batch).argmin(axis=-1), BATCH),
+        f"best_masks (batch of {BATCH})": millis(lambda: best_masks(batch), BATCH),
+    }
+
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    print(f"best_masks matches the exhaustive search on {check(rng)} matrices")
+    for version in VERSIONS:
+        print(f"version {version}, milliseconds per matrix:")
+        for name, millis in bench(version, rng).items():
+            print(f"  {name:28s} {millis:8.3f}")
@@ -0,0 +1,70 @@
+# Penalty scoring: the batched rules against the list based penalty_rule1-4
+#
+# Every rule of calculate_penalties must give the same score as its list based reference,
+# which is checked rule by rule on random matrices and on masked candidates of every
+# version, sparse, balanced and dense, before anything is timed.
+#
+# Usage:
+#   python -m benchmarks.bench_penalties
+
+import timeit
+
+import numpy as np
+
+from benchmarks.bench_masking import random_candidates
+from masking import (calculate_penalties, calculate_penalty, penalty_rule1, penalty_rule1_batch,
+                     penalty_rule2, penalty_rule2_batch, penalty_rule3, penalty_rule3_batch,
+                     penalty_rule4, penalty_rule4_batch)
+
+VERSIONS = [1, 5, 10, 25, 40]
+BATCH = 64
+RULES = [(penalty_rule1, penalty_rule1_batch), (penalty_rule2, penalty_rule2_batch),
+         (penalty_rule3, penalty_rule3_batch), (penalty_rule4, penalty_rule4_batch)]
+
+
+# random matrices (more of the small versions, the reference rules are slow on large
+# ones) plus the 8 masked candidates of one random code per density
+def random_matrices(version: int, rng: np.random.Generator, density: float) -> np.ndarray:
+    size = 4 * version + 17
+    count = max(8, 400 // version)
+    matrices = (rng.random((count, size, size)) < density).astype(np.uint8)
+
+    return np.concatenate([matrices, random_candidates(version, 1, rng, density)[0]])
+
+
+# same score as the reference for every rule
+def check(rng: np.random.Generator) -> int:
+    checked = 0
+    for version in range(1, 41):
+        for density in (0.1, 0.5, 0.9):
+            matrices = random_matrices(version, rng, density)
+            lists = [matrix.tolist() for matrix in matrices]
+            for number, (reference, batched) in enumerate(RULES, 1):
+                expected = [reference(matrix) for matrix in lists]
+                if not np.array_equal(batched(matrices), expected):
+                    raise AssertionError(f"penalty rule {number} differs from the reference at version {version}")
+            checked += len(matrices)
+
+    return checked
+
+
+def bench(version: int, rng: np.random.Generator, number: int = 3) -> dict[str, float]:
+    batch = random_candidates(version, BATCH // 8, rng).reshape(BATCH, 4 * version + 17, -1)
+    lists = [matrix.tolist() for matrix in batch]
+
+    def millis(fn, count: int = 1) -> float:
+        return min(timeit.repeat(fn, number=number, repeat=3)) / number / count * 1e3
+
+    return {
+        "calculate_penalty (lists)": millis(lambda: [calculate_penalty(matrix) for matrix in lists], BATCH),
+        f"calculate_penalties (batch of {BATCH})": millis(lambda: calculate_penalties(batch), BATCH),
+    }
+
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    print(f"batched penalty rules match the reference on {check(rng)} matrices")
+    for version in VERSIONS:
+        print(f"version {version}, milliseconds per matrix:")
+        for name, millis in bench(version, rng, 1 if version > 10 else 3).items():
+            print(f"  {name:36s} {millis:8.3f}")
@@ -0,0 +1,203 @@
+# Per-stage timings of the generation pipeline, per version, written to JSON
+#
+# Every stage is timed for each version (the pure Python list based functions only up to
+# --legacy-max-version, they take seconds on large versions), then the Flask /generate
+# route is driven end to end through the test client. Comparing against an earlier
+# results file prints the ratio of every stage and flags regressions.
+#
+# Usage:
+#   python -m benchmarks.bench_pipeline --output results.json
+#   python -m benchmarks.bench_pipeline --versions 1 10 40 --baseline old.json
+
+import argparse
+import datetime
+import json
+import platform
+import sys
+import tempfile
+import timeit
+
+import numpy as np
+
+from encoding import DATA_CODEWORDS, generate_codewords
+from format_info import FORMAT_BITS, get_format_info_bits
+from image_utils import save_matrix_as_image
+from masking import apply_mask, apply_masks, best_masks, calculate_penalty
+from matrix import (create_full_matrix, initialise_arrays, initialise_matrix, place_codewords, place_data_bits,
+                    place_format_bits)
+
+DEFAULT_VERSIONS = [1, 2, 5, 10, 20, 40]
+PIXEL_SIZES = [1, 4, 10]
+LEGACY_MAX_VERSION = 10
+REGRESSION_THRESHOLD = 1.10
+
+
+# seconds per call, best of repeat runs of an automatically sized loop
+def time_call(fn, repeat: int = 5) -> tuple[float, int]:
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+
+    return min(timer.repeat(repeat=repeat, number=number)) / number, number
+
+
+# text that fills the byte mode data capacity of a version at level L
+def text_for_version(version: int) -> str:
+    count_bits = 8 if version <= 9 else 16
+    length = (DATA_CODEWORDS['L'][version] * 8 - 4 - count_bits) // 8
+
+    return ('QR pipeline benchmark ' * (length // 22 + 1))[:length]
+
+
+def bench_version(version: int, legacy: bool) -> list[dict]:
+    from app import matrix_to_png_bytes
+
+    text = text_for_version(version)
+    data_cw, ecc_cw = generate_codewords(text, version)
+    bits = ''.join(format(b, '08b') for b in data_cw + ecc_cw)
+    modules, reserved = initialise_arrays(version)
+    place_codewords(modules, data_cw + ecc_cw)
+    candidates = apply_masks(modules, reserved)
+    final = candidates[int(best_masks(candidates))]
+
+    stages = {
+        'encoding.generate_codewords': lambda: generate_codewords(text, version),
+        'matrix.initialise_arrays': lambda: initialise_arrays(version),
+        'matrix.place_codewords': lambda: place_codewords(modules.copy(), data_cw + ecc_cw),
+        'masking.apply_masks+best_masks': lambda: best_masks(apply_masks(modules, reserved)),
+        'format_info.get_format_info_bits': lambda: [get_format_info_bits('L', mask) for mask in range(8)],
+        'matrix.place_format_bits': lambda: place_format_bits(final, FORMAT_BITS['L'][0]),
+    }
+    if legacy:
+        matrix, reserved_list = create_full_matrix(version, bits, '')
+        stages.update({
+            'matrix.initialise_matrix': lambda: initialise_matrix(version),
+            'matrix.place_data_bits': lambda: place_data_bits([row[:] for row in matrix], reserved_list, bits),
+            'masking.apply_mask+calculate_penalty': lambda: [calculate_penalty(apply_mask(matrix, reserved_list, mask))
+                                                             for mask in range(8)],
+        })
+
+    results = []
+    for stage, fn in stages.items():
+        seconds, calls = time_call(fn, repeat=3 if 'calculate_penalty' in stage else 5)
+        results.append({'stage': stage, 'version': version, 'seconds': seconds, 'calls': calls})
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for pixel_size in PIXEL_SIZES:
+            path = f'{tmp}/qr.png'
+            renders = {
+                'image_utils.save_matrix_as_image': lambda: save_matrix_as_image(final, path, pixel_size, show=False),
+                'app.matrix_to_png_bytes': lambda: matrix_to_png_bytes(final, pixel_size),
+            }
+            for stage, fn in renders.items():
+                seconds, calls = time_call(fn)
+                results.append({'stage': stage, 'version': version, 'pixel_size': pixel_size,
+                                'seconds': seconds, 'calls': calls})
+
+    return results
+
+
+# requests per second through the Flask test client, the page alone, the page plus its
+# image with an empty render cache, and the slideshow page
+def bench_flask(versions: list[int], requests: int = 50) -> list[dict]:
+    from app import app, render_cache
+
+    client = app.test_client()
+    results = []
+    for version in versions:
+        text = text_for_version(version)
+        form = {'text': text, 'foreground_colour': '#000000', 'background_colour': '#ffffff',
+                'shape': 'square', 'pixel_size': '10'}
+
+        def page():
+            return client.post('/generate', data=form)
+
+        def page_and_image():
+            render_cache.clear()
+            html = page().get_data(as_text=True)
+            url = html.split('<img src="', 1)[1].split('"', 1)[0].replace('&amp;', '&')
+            return client.get(url)
+
+        def slideshow():
+            return client.post('/generate', data={**form, 'slideshow': 'on'})
+
+        for name, fn in (('/generate', page), ('/generate + /qr.png', page_and_image),
+                         ('/generate slideshow', slideshow)):
+            assert fn().status_code == 200
+            count = max(5, requests // version)
+            seconds = min(timeit.repeat(fn, number=count, repeat=3)) / count
+            results.append({'stage': f'flask {name}', 'version': version, 'seconds': seconds,
+                            'requests_per_second': 1 / seconds, 'calls': count})
+
+    return results
+
+
+def _label(result: dict) -> str:
+    extra = f" px={result['pixel_size']}" if 'pixel_size' in result else ''
+
+    return f"{result['stage']} v{result['version']}{extra}"
+
+
+# print the ratio of every stage against an earlier run, returns the regressions
+def compare(results: list[dict], baseline: list[dict], threshold: float = REGRESSION_THRESHOLD) -> list[str]:
+    previous = {_label(r): r['seconds'] for r in baseline}
+    regressions = []
+    for result in results:
+        label = _label(result)
+        if label not in previous:
+            continue
+        ratio = result['seconds'] / previous[label]
+        flag = ' REGRESSION' if ratio > threshold else ''
+        print(f"  {label:60s} {ratio:6.2f}x{flag}")
+        if flag:
+            regressions.append(label)
+
+    return regressions
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Time every pipeline stage per version.")
+    parser.add_argument("--versions", type=int, nargs="+", default=DEFAULT_VERSIONS)
+    parser.add_argument("--legacy-max-version", type=int, default=LEGACY_MAX_VERSION,
+                        help="Largest version to time the list based functions on.")
+    parser.add_argument("--output", "-o", help="Write results to this JSON file.")
+    parser.add_argument("--baseline", help="Earlier results file to compare against.")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                        help="Slowdown ratio reported as a regression.")
+    parser.add_argument("--no-flask", action="store_true", help="Skip the /generate throughput test.")
+    args = parser.parse_args(argv)
+
+    results = []
+    for version in args.versions:
+        for result in bench_version(version, version <= args.legacy_max_version):
+            results.append(result)
+            print(f"{_label(result):60s} {result['seconds'] * 1e3:10.3f} ms")
+    if not args.no_flask:
+        for result in bench_flask(args.versions):
+            results.append(result)
+            print(f"{_label(result):60s} {result['requests_per_second']:10.1f} req/s")
+
+    report = {
+        'meta': {
+            'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'python': sys.version.split()[0],
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'processor': platform.processor() or platform.machine(),
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        print(f"Compared with {args.baseline} (new / old time):")
+        return 1 if compare(results, baseline, args.threshold) else 0
+
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
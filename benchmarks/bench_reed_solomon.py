@@ -0,0 +1,77 @@
+# Reed-Solomon encoding throughput against reedsolo
+#
+# rs_encode_blocks must give the same ECC codewords as rs_encode (and reedsolo, when it is
+# installed) for every ECC length a QR code uses, which is checked before anything is timed.
+#
+# Usage:
+#   python -m benchmarks.bench_reed_solomon
+
+import timeit
+
+import numpy as np
+
+from encoding import ECC_CODEWORDS_PER_BLOCK
+from reed_solomon import rs_encode, rs_encode_blocks
+
+try:
+    import reedsolo
+except ImportError:
+    reedsolo = None
+
+# (data codewords, ecc codewords) per block
+CASES = [(19, 7), (34, 10), (116, 20), (15, 30)]
+BATCH = 1000
+CHECKS = 64
+
+
+# same codewords from the batch encoder, the single block encoder and reedsolo
+def check(rng: np.random.Generator) -> int:
+    checked = 0
+    for ecc_count in sorted({n for counts in ECC_CODEWORDS_PER_BLOCK.values() for n in counts[1:]}):
+        for data_count in (1, 15, 19, 54, 123):
+            blocks = rng.integers(0, 256, (CHECKS, data_count), dtype=np.uint8)
+            batched = rs_encode_blocks(blocks, ecc_count)
+            for row, ecc in zip(blocks, batched):
+                expected = rs_encode(bytes(row), ecc_count)
+                if ecc.tobytes() != expected:
+                    raise AssertionError(f"rs_encode_blocks differs from rs_encode at k={data_count} ecc={ecc_count}")
+                if reedsolo is not None and bytes(reedsolo.RSCodec(ecc_count).encode(bytearray(row))[-ecc_count:]) != expected:
+                    raise AssertionError(f"rs_encode differs from reedsolo at k={data_count} ecc={ecc_count}")
+            checked += CHECKS
+
+    return checked
+
+
+def bench(data_count: int, ecc_count: int, number: int = 5) -> dict[str, float]:
+    blocks = np.random.default_rng(0).integers(0, 256, (BATCH, data_count), dtype=np.uint8)
+    messages = [bytes(row) for row in blocks]
+    results = {}
+
+    def per_code(fn) -> float:
+        return min(timeit.repeat(fn, number=1, repeat=number)) / BATCH * 1e6
+
+    if reedsolo is not None:
+        def reference():
+            for m in messages:
+                reedsolo.RSCodec(ecc_count).encode(bytearray(m))
+
+        def reference_cached():
+            rs = reedsolo.RSCodec(ecc_count)
+            for m in messages:
+                rs.encode(bytearray(m))
+
+        results["reedsolo (new codec per code)"] = per_code(reference)
+        results["reedsolo (shared codec)"] = per_code(reference_cached)
+
+    results["rs_encode"] = per_code(lambda: [rs_encode(m, ecc_count) for m in messages])
+    results["rs_encode_blocks"] = per_code(lambda: rs_encode_blocks(blocks, ecc_count))
+
+    return results
+
+
+if __name__ == "__main__":
+    print(f"rs_encode_blocks matches rs_encode on {check(np.random.default_rng(0))} blocks")
+    for data_count, ecc_count in CASES:
+        print(f"k={data_count} ecc={ecc_count} ({BATCH} blocks), microseconds per block:")
+        for name, micros in bench(data_count, ecc_count).items():
+            print(f"  {name:32s} {micros:8.2f}")
@@ -0,0 +1,105 @@
+# Start up time of the core encoder and the CLI, checked against a budget
+#
+# Every command is run in a fresh interpreter, round robin so load changes hit them all
+# alike, and the best wall time of --runs is kept. Budgets are the time on top of
+# "python -c 'import numpy'", which the core cannot avoid, so they hold across machines.
+# Importing the core encoder and writing an SVG from the CLI must also leave Flask, PIL
+# and pandas unloaded. Exits with status 1 when a budget or an import check fails.
+#
+# Usage:
+#   python -m benchmarks.bench_startup
+#   python -m benchmarks.bench_startup --runs 20 --output startup.json
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CORE_MODULES = ('encoding', 'matrix', 'masking', 'format_info')
+# modules the core encoder must not pull in
+HEAVY_MODULES = ('flask', 'jinja2', 'werkzeug', 'PIL', 'pandas', 'matplotlib', 'scipy')
+
+# milliseconds on top of importing numpy
+BUDGETS_MS = {
+    'import core': 40,
+    'main.py --help': 60,
+    'main.py text -o qr.svg': 80,
+}
+
+
+# best wall time of each command
+def wall_times(commands: dict[str, list[str]], runs: int) -> dict[str, float]:
+    best = dict.fromkeys(commands, float('inf'))
+    for _ in range(runs):
+        for name, args in commands.items():
+            start = time.perf_counter()
+            subprocess.run(args, cwd=REPO, check=True, stdout=subprocess.DEVNULL)
+            best[name] = min(best[name], time.perf_counter() - start)
+
+    return best
+
+
+# heavy modules loaded as a side effect of running code, reported on the last output line
+def heavy_imports(code: str) -> list[str]:
+    code = f"import sys\n{code}\nprint(' '.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    out = subprocess.run([sys.executable, '-c', code], cwd=REPO, check=True, capture_output=True, text=True)
+
+    return out.stdout.splitlines()[-1].split()
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Check start up time against a budget.")
+    parser.add_argument("--runs", type=int, default=20, help="Runs per command, the best is kept.")
+    parser.add_argument("--output", "-o", help="Write results to this JSON file.")
+    args = parser.parse_args(argv)
+
+    failures = []
+    with tempfile.TemporaryDirectory() as tmp:
+        loaded = heavy_imports(f"import {', '.join(CORE_MODULES)}")
+        if loaded:
+            failures.append(f"importing the core loads {', '.join(loaded)}")
+        svg = os.path.join(tmp, 'qr.svg')
+        loaded_svg = heavy_imports(f"sys.argv = ['main.py', 'Hello World', '-o', {svg!r}]\n"
+                                   f"import runpy\nrunpy.run_path('main.py', run_name='__main__')")
+        if loaded_svg:
+            failures.append(f"writing an SVG from main.py loads {', '.join(loaded_svg)}")
+
+        commands = {
+            'python': [sys.executable, '-c', 'pass'],
+            'import numpy': [sys.executable, '-c', 'import numpy'],
+            'import core': [sys.executable, '-c', f"import {', '.join(CORE_MODULES)}"],
+            'main.py --help': [sys.executable, 'main.py', '--help'],
+            'main.py text -o qr.svg': [sys.executable, 'main.py', 'Hello World', '-o', svg],
+        }
+        times = wall_times(commands, args.runs)
+
+    baseline = times['import numpy']
+    results = []
+    for name, seconds in times.items():
+        overhead_ms = (seconds - baseline) * 1e3
+        budget = BUDGETS_MS.get(name)
+        over = budget is not None and overhead_ms > budget
+        flag = ' OVER BUDGET' if over else ''
+        limit = f" (budget +{budget} ms)" if budget is not None else ''
+        print(f"{name:30s} {seconds * 1e3:8.1f} ms  {overhead_ms:+8.1f} ms over numpy{limit}{flag}")
+        results.append({'command': name, 'seconds': seconds, 'overhead_ms': overhead_ms, 'budget_ms': budget})
+        if over:
+            failures.append(f"{name} is {overhead_ms:.1f} ms over numpy, budget {budget} ms")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'heavy_imports': loaded, 'heavy_imports_svg': loaded_svg, 'results': results}, f, indent=2)
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
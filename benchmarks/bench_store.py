@@ -0,0 +1,88 @@
+# Matrix store: reading codes back from a memory-mapped file against generating them
+#
+# A store is filled with mixed inputs over several appends and every record is checked
+# against a fresh generation (version, mask and packed bits), including through a reader
+# that was opened before the last append and after bytes of an interrupted append were
+# left at the end of the file. Then looking a code up and rendering it is
+# timed next to running the whole pipeline for the same input.
+#
+# Usage:
+#   python -m benchmarks.bench_store
+
+import itertools
+import os
+import tempfile
+import timeit
+
+import numpy as np
+
+from image_utils import render_packed
+from pipeline import QRPipeline
+from store import MatrixStore
+
+COUNT = 2000
+APPENDS = 4
+ECC = 'M'
+
+
+def texts(count: int) -> list[str]:
+    return [f"https://example.com/item/{i:06d}?batch={i % 97}" + "x" * (i % 200) for i in range(count)]
+
+
+def check(path: str, inputs: list[str]) -> int:
+    pipeline = QRPipeline(ECC)
+    codes = [pipeline.run(text) for text in inputs]
+    step = len(inputs) // APPENDS
+    early = None
+    with MatrixStore(path, 'a') as store:
+        for start in range(0, len(inputs), step):
+            store.extend(zip(inputs[start:start + step], codes[start:start + step]))
+            if early is None:
+                early = MatrixStore(path)
+        if store.extend(zip(inputs, codes)):
+            raise AssertionError("payloads already in the store were added again")
+    # an append that never got to update the header
+    with open(path, 'ab') as f:
+        f.write(codes[0].matrix.tobytes() * 3)
+    if len(MatrixStore(path)) != len(inputs):
+        raise AssertionError("an interrupted append changed the committed records")
+
+    for reader in (MatrixStore(path), early):
+        for i in range(len(reader)):
+            stored, code = reader.get(inputs[i], ECC), codes[i]
+            if (stored.version, stored.mask) != (code.version, code.mask) \
+                    or not np.array_equal(stored.matrix.packed, code.matrix.packed):
+                raise AssertionError(f"record {i} does not match its generated code")
+            if stored.matrix.packed.flags.writeable:
+                raise AssertionError("stored matrices must be read-only views")
+
+    return len(inputs)
+
+
+def bench(path: str, inputs: list[str], number: int = 200) -> dict[str, float]:
+    store = MatrixStore(path)
+    pipeline = QRPipeline(ECC)
+    rng = np.random.default_rng(0)
+    picks = itertools.cycle(rng.integers(0, len(inputs), size=len(inputs)).tolist())
+
+    def millis(fn) -> float:
+        return min(timeit.repeat(fn, number=number, repeat=3)) / number * 1e3
+
+    return {
+        "open store": millis(lambda: MatrixStore(path).close()),
+        "store.get": millis(lambda: store.get(inputs[next(picks)], ECC)),
+        "QRPipeline.run": millis(lambda: pipeline.run(inputs[next(picks)])),
+        "store.get + render_packed": millis(lambda: render_packed(store.get(inputs[next(picks)], ECC).matrix)),
+        "QRPipeline.run + render_packed": millis(lambda: render_packed(pipeline.run(inputs[next(picks)]).matrix)),
+    }
+
+
+if __name__ == "__main__":
+    inputs = texts(COUNT)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.qrm")
+        print(f"store round trips {check(path, inputs)} codes over {APPENDS} appends, "
+              f"{os.path.getsize(path) / COUNT:.0f} bytes per code")
+        print("milliseconds per call:")
+        for name, millis in bench(path, inputs).items():
+            print(f"  {name:32s} {millis:8.3f}")
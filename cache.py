@@ -0,0 +1,196 @@
+# Rendered output cache
+#
+# Backends store bytes under string keys and count hits, misses and evictions.
+# MemoryCache is a bounded in-process LRU, FileCache keeps entries in a local directory
+# bounded the same way, evicting the least recently used files first.
+
+import hashlib
+import os
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+
+# stable key for any tuple of parts (text, version, ECC level, colours, shape, ...)
+def cache_key(*parts) -> str:
+
+    return hashlib.sha256(repr(parts).encode('utf-8')).hexdigest()
+
+
+# interface every backend implements, get returns None on a miss
+class CacheBackend(ABC):
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @abstractmethod
+    def get(self, key: str) -> bytes | None:
+        ...
+
+    @abstractmethod
+    def set(self, key: str, value: bytes) -> None:
+        ...
+
+    @abstractmethod
+    def clear(self) -> None:
+        ...
+
+    def stats(self) -> dict[str, int]:
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+
+# in-process LRU capped by entry count and total stored bytes
+class MemoryCache(CacheBackend):
+
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024, max_entries: int = 10000):
+        super().__init__()
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.size_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value: bytes) -> None:
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size_bytes -= len(old)
+            self._entries[key] = value
+            self.size_bytes += len(value)
+            while self.size_bytes > self.max_bytes or len(self._entries) > self.max_entries:
+                _, evicted = self._entries.popitem(last=False)
+                self.size_bytes -= len(evicted)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.size_bytes = 0
+
+    def stats(self) -> dict[str, int]:
+        return {**super().stats(), 'entries': len(self._entries), 'bytes': self.size_bytes}
+
+
+# one file per entry in a local directory, shared between processes on the same host
+# a hit touches the file, so the oldest modification time is the least recently used entry.
+# The size is counted per process from a scan of the directory and the directory is
+# scanned again when the count goes over a cap, which also picks up entries written by
+# other processes, so together they can overshoot a cap until one of them next evicts.
+class FileCache(CacheBackend):
+    TMP_PREFIX = '.tmp-'
+
+    def __init__(self, directory: str, max_bytes: int = 256 * 1024 * 1024, max_entries: int = 100000):
+        super().__init__()
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.size_bytes, self.entries = self._usage(self._scan())
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    # (modification time, size, name) of every entry, temporary files left out
+    def _scan(self) -> list[tuple[float, int, str]]:
+        found = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.startswith(self.TMP_PREFIX):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                found.append((stat.st_mtime, stat.st_size, entry.name))
+
+        return found
+
+    @staticmethod
+    def _usage(found: list[tuple[float, int, str]]) -> tuple[int, int]:
+        return sum(size for _, size, _ in found), len(found)
+
+    def get(self, key: str) -> bytes | None:
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return value
+
+    def set(self, key: str, value: bytes) -> None:
+        if len(value) > self.max_bytes:
+            return
+        path = self._path(key)
+        # write to a temporary file first so readers never see a partial entry
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix=self.TMP_PREFIX)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(value)
+            # a replaced entry gives back its size and does not count as a new one
+            try:
+                replaced = os.stat(path).st_size
+            except FileNotFoundError:
+                replaced = None
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        with self._lock:
+            if replaced is None:
+                self.size_bytes += len(value)
+                self.entries += 1
+            else:
+                self.size_bytes += len(value) - replaced
+            if self.size_bytes > self.max_bytes or self.entries > self.max_entries:
+                self._evict()
+
+    # remove the least recently used files until both caps hold, called with the lock held
+    def _evict(self) -> None:
+        found = sorted(self._scan())
+        size_bytes, entries = self._usage(found)
+        for _, size, name in found:
+            if size_bytes <= self.max_bytes and entries <= self.max_entries:
+                break
+            try:
+                os.remove(self._path(name))
+                self.evictions += 1
+            except FileNotFoundError:
+                pass
+            size_bytes -= size
+            entries -= 1
+        self.size_bytes, self.entries = size_bytes, entries
+
+    def clear(self) -> None:
+        with self._lock:
+            for _, _, name in self._scan():
+                try:
+                    os.remove(self._path(name))
+                except FileNotFoundError:
+                    pass
+            self.size_bytes = self.entries = 0
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {**super().stats(), 'entries': self.entries, 'bytes': self.size_bytes}
@@ -0,0 +1,190 @@
+# Decoder for the clean matrices this project generates
+#
+# Runs the pipeline backwards: format information (both copies, which must agree), version
+# information from version 7, the function patterns (finders, separators, timing,
+# alignment and the dark module must match the version template), unmasking, reading the zig-zag along the placement order,
+# de-interleaving, a Reed-Solomon syndrome check of every block and segment parsing.
+# There is no error correction, any damaged module is reported rather than repaired, which
+# is what a self check of generated output wants.
+#
+# Usage:
+#   decode(matrix).text
+#   for code in decode_many(matrices): ...   # same version, (N, size, size)
+
+from functools import lru_cache
+from typing import NamedTuple
+
+import numpy as np
+
+from encoding import ECC_CODEWORDS_PER_BLOCK, get_block_lengths, get_data_codewords, get_interleave_order
+from format_info import EC_LEVEL_BITS, FORMAT_WORDS, VERSION_WORDS
+from masking import get_mask_grids
+from matrix import as_module_array, get_format_index, get_placement_index, get_template
+from reed_solomon import rs_syndromes
+from segmentation import Segment, parse_segments
+
+
+class DecodeError(ValueError):
+    pass
+
+
+class DecodedCode(NamedTuple):
+    version: int
+    ecc: str
+    mask: int
+    segments: list[Segment]
+
+    @property
+    def text(self) -> str:
+        return ''.join(segment.text for segment in self.segments)
+
+
+_LEVELS_BY_BITS = {bits: level for level, bits in EC_LEVEL_BITS.items()}
+
+# format data (EC level bits << 3 | mask) of every valid 15-bit format word, -1 elsewhere
+_FORMAT_LOOKUP = np.full(1 << 15, -1, dtype=np.int8)
+_FORMAT_LOOKUP[list(FORMAT_WORDS)] = np.arange(32)
+
+
+# integer value of bit rows (..., n), most significant bit first
+def _words(bits: np.ndarray) -> np.ndarray:
+    weights = 1 << np.arange(bits.shape[-1] - 1, -1, -1)
+
+    return bits.astype(np.int64) @ weights
+
+
+# (ecc, mask) of every matrix in an (N, size, size) stack, None where the copies disagree
+def _read_format(modules: np.ndarray) -> list[tuple[str, int] | None]:
+    rows, cols = get_format_index(modules.shape[-1])
+    bits = modules[:, rows, cols]
+    first, second = _FORMAT_LOOKUP[_words(bits[:, :15])], _FORMAT_LOOKUP[_words(bits[:, 15:])]
+
+    return [(_LEVELS_BY_BITS[int(a) >> 3], int(a) & 7) if a >= 0 and a == b else None
+            for a, b in zip(first.tolist(), second.tolist())]
+
+
+# version information cells, bit i (least significant first) at (size - 11 + i % 3, i // 3)
+# and its transpose, most significant bit first
+def _version_cells(size: int) -> tuple[np.ndarray, np.ndarray]:
+    i = np.arange(17, -1, -1)
+
+    return size - 11 + i % 3, i // 3
+
+
+# whether both version information blocks match the version, always true below version 7
+def _version_info_ok(modules: np.ndarray, version: int) -> np.ndarray:
+    if version < 7:
+        return np.ones(modules.shape[0], dtype=bool)
+    a, b = _version_cells(modules.shape[-1])
+    word = VERSION_WORDS[version]
+
+    return (_words(modules[:, a, b]) == word) & (_words(modules[:, b, a]) == word)
+
+
+# flat indices and template values of the function pattern modules of a version, every
+# reserved module except the format and version information
+@lru_cache(maxsize=64)
+def _function_pattern_cells(version: int) -> tuple[np.ndarray, np.ndarray]:
+    template, reserved = get_template(version)
+    size = template.shape[-1]
+    cells = reserved.copy()
+    cells[get_format_index(size)] = False
+    if version >= 7:
+        a, b = _version_cells(size)
+        cells[a, b] = cells[b, a] = False
+    index = np.flatnonzero(cells)
+    expected = template.reshape(-1)[index].astype(bool)
+    index.setflags(write=False)
+    expected.setflags(write=False)
+
+    return index, expected
+
+
+# whether every function pattern module matches the version template
+def _function_patterns_ok(modules: np.ndarray, version: int) -> np.ndarray:
+    index, expected = _function_pattern_cells(version)
+
+    return (modules.reshape(len(modules), -1)[:, index] == expected).all(axis=-1)
+
+
+# unmasked data codewords (N, k) of matrices sharing version, ECC level and nothing else,
+# and a flag per matrix that every RS block checks out
+def _read_codewords(modules: np.ndarray, masks: np.ndarray, version: int, ecc: str) -> tuple[np.ndarray, np.ndarray]:
+    size = modules.shape[-1]
+    _, reserved = get_template(version)
+    unmasked = modules ^ (get_mask_grids(size)[masks] & ~reserved)
+
+    lengths = get_block_lengths(version, ecc)
+    ecc_count = ECC_CODEWORDS_PER_BLOCK[ecc][version]
+    data_count = get_data_codewords(version, ecc)
+    total = data_count + ecc_count * len(lengths)
+    index = get_placement_index(version)[:8 * total]
+    codewords = np.packbits(unmasked.reshape(len(modules), -1)[:, index], axis=-1)
+
+    # undo the interleaving: data back to block-major order, ECC to (N, blocks, ecc_count)
+    data = np.empty((len(modules), data_count), dtype=np.uint8)
+    data[:, get_interleave_order(version, ecc)] = codewords[:, :data_count]
+    ecc_blocks = codewords[:, data_count:].reshape(len(modules), ecc_count, len(lengths)).transpose(0, 2, 1)
+
+    # short and long blocks are each checked as one (N * blocks, length) batch
+    ok = np.ones(len(modules), dtype=bool)
+    num_short = lengths.count(lengths[0])
+    split = num_short * lengths[0]
+    for data_part, ecc_part, length in ((data[:, :split], ecc_blocks[:, :num_short], lengths[0]),
+                                        (data[:, split:], ecc_blocks[:, num_short:], lengths[0] + 1)):
+        if ecc_part.shape[1] == 0:
+            continue
+        full = np.concatenate([data_part.reshape(len(modules), -1, length), ecc_part], axis=-1)
+        syndromes = rs_syndromes(full.reshape(-1, full.shape[-1]), ecc_count)
+        ok &= ~syndromes.reshape(len(modules), -1).any(axis=-1)
+
+    return data, ok
+
+
+# decode every matrix of an (N, size, size) stack of one version, results are in input
+# order with a DecodeError in place of any matrix that fails a check
+def decode_many(matrices) -> list[DecodedCode | DecodeError]:
+    modules = np.asarray(matrices).astype(bool)
+    if modules.ndim != 3 or modules.shape[-1] != modules.shape[-2] or (modules.shape[-1] - 17) % 4:
+        raise ValueError("Expected an (N, size, size) stack of QR matrices")
+    version = (modules.shape[-1] - 17) // 4
+    if not 1 <= version <= 40:
+        raise ValueError(f"No QR version has {modules.shape[-1]} modules per side")
+
+    results = [None] * len(modules)
+    formats = _read_format(modules)
+    version_ok = _version_info_ok(modules, version)
+    patterns_ok = _function_patterns_ok(modules, version)
+    groups = {}
+    for i, (fmt, version_valid, patterns_valid) in enumerate(zip(formats, version_ok.tolist(), patterns_ok.tolist())):
+        if fmt is None:
+            results[i] = DecodeError("Format information is invalid or the two copies differ")
+        elif not version_valid:
+            results[i] = DecodeError(f"Version information does not match version {version}")
+        elif not patterns_valid:
+            results[i] = DecodeError(f"Function patterns do not match the version {version} template")
+        else:
+            groups.setdefault(fmt[0], []).append(i)
+
+    for ecc, indices in groups.items():
+        masks = np.array([formats[i][1] for i in indices])
+        data, ok = _read_codewords(modules[indices], masks, version, ecc)
+        for j, i in enumerate(indices):
+            if not ok[j]:
+                results[i] = DecodeError("Reed-Solomon check failed")
+                continue
+            try:
+                results[i] = DecodedCode(version, ecc, int(masks[j]), parse_segments(data[j].tobytes(), version))
+            except (ValueError, UnicodeDecodeError) as e:
+                results[i] = DecodeError(f"Invalid data segments: {e}")
+
+    return results
+
+
+# decode one list, array or QRMatrix, raises DecodeError when a check fails
+def decode(matrix) -> DecodedCode:
+    result = decode_many(np.asarray(as_module_array(matrix))[None])[0]
+    if isinstance(result, DecodeError):
+        raise result
+
+    return result
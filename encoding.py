@@ -1,76 +1,226 @@
-import reedsolo
+import numpy as np
+from functools import lru_cache
+
+import metrics
+from reed_solomon import rs_encode_blocks
+from segmentation import VERSION_GROUPS, append_segment, make_segments, segments_bit_length
+
+MIN_VERSION, MAX_VERSION = 1, 40
+ECC_LEVELS = ('L', 'M', 'Q', 'H')
+
+# ECC codewords per RS block and number of RS blocks, indexed by version (index 0 unused)
+ECC_CODEWORDS_PER_BLOCK = {
+    'L': (0, 7, 10, 15, 20, 26, 18, 20, 24, 30, 18, 20, 24, 26, 30, 22, 24, 28, 30, 28, 28,
+          28, 28, 30, 30, 26, 28, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30),
+    'M': (0, 10, 16, 26, 18, 24, 16, 18, 22, 22, 26, 30, 22, 22, 24, 24, 28, 28, 26, 26, 26,
+          26, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28),
+    'Q': (0, 13, 22, 18, 26, 18, 24, 18, 22, 20, 24, 28, 26, 24, 20, 30, 24, 28, 28, 26, 30,
+          28, 30, 30, 30, 30, 28, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30),
+    'H': (0, 17, 28, 22, 16, 22, 28, 26, 26, 24, 28, 24, 28, 22, 24, 24, 30, 28, 28, 26, 28,
+          30, 24, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30),
+}
+NUM_ECC_BLOCKS = {
+    'L': (0, 1, 1, 1, 1, 1, 2, 2, 2, 2, 4, 4, 4, 4, 4, 6, 6, 6, 6, 7, 8,
+          8, 9, 9, 10, 12, 12, 12, 13, 14, 15, 16, 17, 18, 19, 19, 20, 21, 22, 24, 25),
+    'M': (0, 1, 1, 1, 2, 2, 4, 4, 4, 5, 5, 5, 8, 9, 9, 10, 10, 11, 13, 14, 16,
+          17, 17, 18, 20, 21, 23, 25, 26, 28, 29, 31, 33, 35, 37, 38, 40, 43, 45, 47, 49),
+    'Q': (0, 1, 1, 2, 2, 4, 4, 6, 6, 8, 8, 8, 10, 12, 16, 12, 17, 16, 18, 21, 20,
+          23, 23, 25, 27, 29, 34, 34, 35, 38, 40, 43, 45, 48, 51, 53, 56, 59, 62, 65, 68),
+    'H': (0, 1, 1, 2, 4, 4, 4, 5, 6, 8, 8, 11, 11, 16, 16, 18, 16, 19, 21, 25, 25,
+          25, 34, 30, 32, 35, 37, 40, 42, 45, 48, 51, 54, 57, 60, 63, 66, 70, 74, 77, 81),
+}
+
+
+# modules left for data and ECC once every function pattern is placed
+def get_raw_data_modules(version: int) -> int:
+    result = (16 * version + 128) * version + 64
+    if version >= 2:
+        num_align = version // 7 + 2
+        result -= (25 * num_align - 10) * num_align - 55
+        if version >= 7:
+            result -= 36
+
+    return result
+
+
+# codeword and remainder bit counts, indexed by version (index 0 unused)
+TOTAL_CODEWORDS = (0,) + tuple(get_raw_data_modules(v) // 8 for v in range(MIN_VERSION, MAX_VERSION + 1))
+REMAINDER_BITS = (0,) + tuple(get_raw_data_modules(v) % 8 for v in range(MIN_VERSION, MAX_VERSION + 1))
+DATA_CODEWORDS = {
+    level: (0,) + tuple(TOTAL_CODEWORDS[v] - ECC_CODEWORDS_PER_BLOCK[level][v] * NUM_ECC_BLOCKS[level][v]
+                        for v in range(MIN_VERSION, MAX_VERSION + 1))
+    for level in ECC_LEVELS
+}
+
+
+def _check(version: int, ecc: str) -> None:
+    if not MIN_VERSION <= version <= MAX_VERSION:
+        raise ValueError("Unsupported version")
+    if ecc not in ECC_LEVELS:
+        raise ValueError(f"Invalid error correction level: {ecc}. Must be L, M, Q, or H.")
+
+
+def get_data_codewords(version: int, ecc: str = 'L') -> int:
+    _check(version, ecc)
+
+    return DATA_CODEWORDS[ecc][version]
+
+
+# data capacity in bits per version (index 0 unused) and, for every bit count up to the
+# version 40 capacity, the smallest version that holds it
+DATA_CAPACITY_BITS = {level: tuple(n * 8 for n in DATA_CODEWORDS[level]) for level in ECC_LEVELS}
+_SMALLEST_VERSION = {
+    level: np.searchsorted(DATA_CAPACITY_BITS[level][1:], np.arange(DATA_CAPACITY_BITS[level][-1] + 1)).astype(np.uint8) + 1
+    for level in ECC_LEVELS
+}
+
+# pad codewords 0xEC, 0x11 alternating
+PAD_CODEWORDS = b'\xec\x11'
+
+# optional debug hook called as hook(label, bits) at each encoding step, off by default
+_trace_hook = None
+
+
+# install a debug hook for the encoding pipeline, pass None to switch tracing off
+def set_trace_hook(hook) -> None:
+    global _trace_hook
+    _trace_hook = hook
+
+
+# debug hook printing every step as groups of 8 bits
+def print_trace(label: str, bits: str) -> None:
+    print(f"{label}:\n {split_bit_string(bits)}\n")
+
+
+def _trace(label: str, payload) -> None:
+    if _trace_hook is not None:
+        bits = payload if isinstance(payload, str) else ''.join(format(b, '08b') for b in payload)
+        _trace_hook(label, bits)
+
+
+# bit buffer that appends fields most significant bit first and reads out as a bytearray
+class BitBuffer:
+    __slots__ = ('value', 'length')
+
+    def __init__(self):
+        self.value = 0
+        self.length = 0
+
+    def append(self, value: int, length: int) -> None:
+        self.value = (self.value << length) | value
+        self.length += length
+
+    # zero bits are added to reach a byte boundary
+    def to_bytearray(self) -> bytearray:
+        pad = -self.length % 8
+
+        return bytearray((self.value << pad).to_bytes((self.length + pad) // 8, 'big'))
+
 
 # split string into chunks of 8 and join them with a space
 def split_bit_string(bit_string: str) -> str:
 
     return ' '.join(bit_string[i:i+8] for i in range(0, len(bit_string), 8))
 
-# encode input string into bit string for given version.
-def encode_bytes(data: str, version: int) -> str:
-    mode_indicator = '0100'
-    char_count_bits = format(len(data), '08b') # character count
-    byte_data = data.encode('iso-8859-1', 'strict')
-    data_bits = ''.join(format(b, '08b') for b in byte_data)
 
-    full = mode_indicator + char_count_bits + data_bits
-    print(f"Data Bits (mode+len+data):\n {split_bit_string(full)}\n")
+# smallest version that holds the optimal segmentation of the input, one table lookup per
+# character count width group
+def choose_version(data: str, ecc: str = 'L') -> int:
+    _check(MIN_VERSION, ecc)
+    smallest = _SMALLEST_VERSION[ecc]
+    for first, last in VERSION_GROUPS:
+        bits = segments_bit_length(make_segments(data, first), first)
+        if bits < len(smallest) and smallest[bits] <= last:
+            return max(first, int(smallest[bits]))
 
-    return full
+    raise ValueError(f"Input too long for version {MAX_VERSION}-{ecc} ({bits} data bits, max {len(smallest) - 1}).")
 
 
-# add terminator and padding to make length a multiple of 8, and fill capacity
-def add_terminator_and_padding(bit_string: str, version: int) -> str:
-    # data capacity. v1=19, v2=34
-    data_codewords = {1: 19, 2: 34}.get(version)
-    if data_codewords is None:
-        raise ValueError("Unsupported version")
+# write the segments, terminator and pad codewords straight into a bytearray
+def encode_data_codewords(data: str, version: int, ecc: str = 'L') -> bytearray:
+    data_codewords = get_data_codewords(version, ecc)
     data_capacity = data_codewords * 8
 
-    # terminator
-    terminator_len = min(4, data_capacity - len(bit_string))
-    bit_string += '0' * terminator_len
-    print(f"Padded with termiantor ({terminator_len} bits):\n {split_bit_string(bit_string)}\n")
+    buffer = BitBuffer()
+    for segment in make_segments(data, version):
+        append_segment(buffer, segment, version)
+    if buffer.length > data_capacity:
+        raise ValueError(f"Input too long for version {version}-{ecc}.")
 
-    # pad to byte boundary
-    while len(bit_string) % 8 != 0:
-        bit_string += '0'
-    print(f"Padded to byte boundary:\n {split_bit_string(bit_string)}")
+    # terminator, then zero bits to the byte boundary
+    buffer.append(0, min(4, data_capacity - buffer.length))
+    codewords = buffer.to_bytearray()
 
-    # pad bytes 0xEC, 0x11 alternating
-    pad_bytes = ['11101100', '00010001']
-    i = 0
-    while len(bit_string) < data_capacity:
-        bit_string += pad_bytes[i % 2]
-        i += 1
-    print(f"Padded to capacity ({data_capacity} bits):\n {split_bit_string(bit_string)}\n")
+    pad_count = data_codewords - len(codewords)
+    codewords += (PAD_CODEWORDS * (pad_count // 2 + 1))[:pad_count]
+    _trace(f"Data codewords ({data_capacity} bits)", codewords)
 
-    return bit_string
+    return codewords
 
 
-# convert bit string into a list of integer byte values
-def bits_to_bytes(bit_string: str) -> list[int]:
+# data block lengths for a version and level, short blocks come first and long blocks
+# carry one extra data codeword
+def get_block_lengths(version: int, ecc: str = 'L') -> list[int]:
+    _check(version, ecc)
+    num_blocks = NUM_ECC_BLOCKS[ecc][version]
+    num_long = TOTAL_CODEWORDS[version] % num_blocks
+    short_len = TOTAL_CODEWORDS[version] // num_blocks - ECC_CODEWORDS_PER_BLOCK[ecc][version]
 
-    return [int(bit_string[i:i+8], 2) for i in range(0, len(bit_string), 8)]
+    return [short_len] * (num_blocks - num_long) + [short_len + 1] * num_long
 
 
-# get message coefficients and generate error correction codewords
-def generate_codewords(data: str, version: int) -> tuple[list[int], list[int]]:
-    bit_stream = encode_bytes(data, version)
-    padded = add_terminator_and_padding(bit_stream, version)
-    data_bytes = bits_to_bytes(padded)
-    print(f"Data codewords (bytes):\n {data_bytes}\n")
-
-    # ECC codeword count v1=7, v2=10
-    ecc_count = {1: 7, 2: 10}.get(version)
-    if ecc_count is None:
-        raise ValueError("Unsupported version")
-    rs = reedsolo.RSCodec(ecc_count)
-    full = list(rs.encode(bytearray(data_bytes)))
-    data_codewords = full[:-ecc_count]
-    ecc_codewords = full[-ecc_count:]
+# positions of the block-major data codewords in interleaved order (one codeword of each
+# block in turn, short blocks dropping out of the last round)
+@lru_cache(maxsize=None)
+def get_interleave_order(version: int, ecc: str = 'L') -> np.ndarray:
+    lengths = get_block_lengths(version, ecc)
+    starts = np.cumsum([0] + lengths[:-1])
+    order = [start + i for i in range(max(lengths)) for start, length in zip(starts, lengths) if i < length]
+    order = np.array(order, dtype=np.intp)
+    order.setflags(write=False)
 
-    remainder_bits = {1: 0, 2: 7}.get(version)
-    full_bits = ''.join(format(b, '08b') for b in full) + ('0' * remainder_bits)
-    print(f"Full encoded + remainder ({remainder_bits} bits):\n {split_bit_string(full_bits)}\n")
+    return order
 
-    return data_codewords, ecc_codewords
\ No newline at end of file
+
+# split data codewords (..., k) into RS blocks, add ECC to each and interleave both parts
+# returns the final (..., total) codeword sequence
+def interleave_codewords(data: np.ndarray, version: int, ecc: str = 'L') -> np.ndarray:
+    data = np.asarray(data, dtype=np.uint8)
+    lengths = get_block_lengths(version, ecc)
+    ecc_count = ECC_CODEWORDS_PER_BLOCK[ecc][version]
+    batch = data.shape[:-1]
+    flat = data.reshape(-1, data.shape[-1])
+
+    # short and long blocks are each encoded as one (n * blocks, length) batch
+    ecc_blocks = np.empty((flat.shape[0], len(lengths), ecc_count), dtype=np.uint8)
+    num_short = lengths.count(lengths[0])
+    split = num_short * lengths[0]
+    ecc_blocks[:, :num_short] = rs_encode_blocks(
+        flat[:, :split].reshape(-1, lengths[0]), ecc_count).reshape(flat.shape[0], num_short, ecc_count)
+    if num_short < len(lengths):
+        ecc_blocks[:, num_short:] = rs_encode_blocks(
+            flat[:, split:].reshape(-1, lengths[0] + 1), ecc_count).reshape(flat.shape[0], -1, ecc_count)
+
+    interleaved_data = flat[:, get_interleave_order(version, ecc)]
+    interleaved_ecc = ecc_blocks.transpose(0, 2, 1).reshape(flat.shape[0], -1)
+    full = np.concatenate([interleaved_data, interleaved_ecc], axis=1)
+
+    return full.reshape(*batch, full.shape[-1])
+
+
+# get message coefficients and generate error correction codewords
+# returns the interleaved data and ECC codewords, placed one after the other
+def generate_codewords(data: str, version: int, ecc: str = 'L') -> tuple[bytes, bytes]:
+    with metrics.stage('encode'):
+        data_bytes = encode_data_codewords(data, version, ecc)
+    with metrics.stage('reed_solomon'):
+        full = interleave_codewords(np.frombuffer(bytes(data_bytes), dtype=np.uint8), version, ecc).tobytes()
+    data_codewords = full[:len(data_bytes)]
+    ecc_codewords = full[len(data_bytes):]
+
+    if _trace_hook is not None:
+        remainder_bits = REMAINDER_BITS[version]
+        _trace(f"Full encoded + remainder ({remainder_bits} bits)",
+               ''.join(format(b, '08b') for b in full) + ('0' * remainder_bits))
+
+    return data_codewords, ecc_codewords
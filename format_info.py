@@ -0,0 +1,83 @@
+import numpy as np
+
+EC_LEVEL_BITS = {'L': 0b01, 'M': 0b00, 'Q': 0b11, 'H': 0b10}
+
+
+# 15-bit format word (BCH code, then XOR mask) for 5 bits of format data
+def _format_word(fmt: int) -> int:
+    poly = 0b10100110111  # Polynomial for format info
+    data = fmt << 10
+    # Polynomial division to calculate remainder
+    for i in range(14, 9, -1):
+        if (data >> i) & 1:
+            data ^= (poly << (i - 10))
+
+    # Append remainder and fixed mask 0b101010000010010
+    return ((fmt << 10) | data) ^ 0b101010000010010
+
+
+# 18-bit version word, 6 version bits followed by 12 BCH error correction bits
+def _version_word(version: int) -> int:
+    poly = 0b1111100100101  # Generator polynomial for version info
+    data = version << 12
+    # Polynomial division to calculate remainder
+    for i in range(17, 11, -1):
+        if (data >> i) & 1:
+            data ^= (poly << (i - 12))
+
+    return (version << 12) | data
+
+
+# all 32 format words, indexed by EC level bits << 3 | mask pattern
+FORMAT_WORDS = tuple(_format_word(fmt) for fmt in range(32))
+
+# version words indexed by version, 0 below version 7 where there is no version information
+VERSION_WORDS = tuple(_version_word(version) if version >= 7 else 0 for version in range(41))
+
+
+def _bit_array(words, length: int) -> np.ndarray:
+    bits = np.array([[(word >> (length - 1 - i)) & 1 for i in range(length)] for word in words], dtype=np.uint8)
+    bits.setflags(write=False)
+
+    return bits
+
+
+# format bits, most significant first, as an (8, 15) array per EC level indexed by mask
+FORMAT_BITS = {level: _bit_array([FORMAT_WORDS[ec_bits << 3 | mask] for mask in range(8)], 15)
+               for level, ec_bits in EC_LEVEL_BITS.items()}
+
+
+# calculates the format information bit string
+def get_format_info_bits(ec_level: str, mask_pattern: int) -> str:
+    """
+    Calculates the format information bit string based on the error correction level and mask pattern.
+
+    Args:
+        ec_level: L, M, Q, or H
+        mask_pattern: 0 to 7
+
+    Returns:
+        A 15-bit string representing the format information.
+    """
+    if ec_level not in EC_LEVEL_BITS:
+        raise ValueError(f"Invalid error correction level: {ec_level}. Must be L, M, Q, or H.")
+
+    # Combine EC bits and mask bits
+    return format(FORMAT_WORDS[(EC_LEVEL_BITS[ec_level] << 3) | mask_pattern], '015b')
+
+
+# calculates the version information bit string (versions 7 to 40)
+def get_version_info_bits(version: int) -> str:
+    """
+    Calculates the version information bit string for versions 7 and up.
+
+    Args:
+        version: 7 to 40
+
+    Returns:
+        An 18-bit string, 6 version bits followed by 12 BCH error correction bits.
+    """
+    if not 7 <= version <= 40:
+        raise ValueError(f"Version information only exists for versions 7 to 40, got {version}.")
+
+    return format(VERSION_WORDS[version], '018b')
@@ -1,21 +1,139 @@
-from PIL import Image
+import numpy as np
+from functools import lru_cache
+from PIL import Image, ImageColor, ImageDraw, ImageOps
+
+from matrix import QRMatrix, as_module_array
+
+
+# pixels covered by one module, extent is pixel_size + 1 when the box includes its far
+# edge like ImageDraw.rectangle / ellipse, circles are drawn once and cached
+@lru_cache(maxsize=64)
+def get_module_sprite(pixel_size: int, shape: str = 'square', extent: int | None = None) -> np.ndarray:
+    extent = pixel_size + 1 if extent is None else extent
+    if shape == 'circle':
+        img = Image.new("1", (extent, extent), 0)
+        ImageDraw.Draw(img).ellipse([0, 0, extent - 1, extent - 1], fill=1)
+        sprite = np.array(img, dtype=bool)
+    else:
+        sprite = np.ones((extent, extent), dtype=bool)
+    sprite.setflags(write=False)
+
+    return sprite
+
+
+# dark modules and drawn modules (anything but None) of a list, array or QRMatrix
+def _module_masks(matrix) -> tuple[np.ndarray, np.ndarray]:
+    matrix = as_module_array(matrix)
+    if isinstance(matrix, np.ndarray):
+        return matrix == 1, np.ones(matrix.shape, dtype=bool)
+    dark = np.array([[v == 1 for v in row] for row in matrix], dtype=bool)
+    drawn = np.array([[v is not None for v in row] for row in matrix], dtype=bool)
+
+    return dark, drawn
+
+
+# foreground flag of every pixel when each drawn module stamps the sprite in row-major
+# order, so a later module wins where two sprites overlap
+def _stamp_modules(dark: np.ndarray, drawn: np.ndarray, sprite: np.ndarray, pixel_size: int) -> np.ndarray:
+    size = dark.shape[0]
+    extent = sprite.shape[0]
+
+    # whole-module squares need no overlap resolution, just scale and repeat the edge
+    if sprite.all() and drawn.all():
+        pixels = np.repeat(np.repeat(dark, pixel_size, axis=0), pixel_size, axis=1)
+        overhang = extent - pixel_size
+        return np.pad(pixels, ((0, overhang), (0, overhang)), mode='edge') if overhang else pixels
+
+    # along each axis a pixel lies in its own module and, on the shared edge, the one before
+    coords = np.arange((size - 1) * pixel_size + extent)
+    cell, local = coords // pixel_size, coords % pixel_size
+    axes = [(np.minimum(cell, size - 1), cell < size, local),
+            (np.maximum(cell - 1, 0), (cell >= 1) & (local + pixel_size < extent), np.minimum(local + pixel_size, extent - 1))]
+
+    # 0 for undrawn, 1 for light and 2 for dark, gathered one axis at a time
+    codes = np.where(drawn, dark.astype(np.uint8) + 1, 0).astype(np.uint8)
+    pixels = np.zeros((coords.size, coords.size), dtype=bool)
+    done = np.zeros((coords.size, coords.size), dtype=bool)
+    for rows, row_valid, row_local in axes:
+        row_codes = codes.take(rows, axis=0) * row_valid[:, None]
+        row_sprite = sprite.take(row_local, axis=0)
+        for cols, col_valid, col_local in axes:
+            code = row_codes.take(cols, axis=1) * col_valid
+            hit = (code > 0) & row_sprite.take(col_local, axis=1) & ~done
+            pixels |= hit & (code == 2)
+            done |= hit
+
+    return pixels
+
+
+# foreground flag of every pixel of the image, quiet zone included
+def _render_pixels(matrix, pixel_size: int, border: int, shape: str, extent: int | None) -> np.ndarray:
+    dark, drawn = _module_masks(matrix)
+    sprite = get_module_sprite(pixel_size, shape, extent)
+    modules = _stamp_modules(dark, drawn, sprite, pixel_size)
+
+    img_size = (dark.shape[0] + 2*border) * pixel_size
+    offset = border * pixel_size
+    pixels = np.zeros((img_size, img_size), dtype=bool)
+    span = min(modules.shape[0], img_size - offset)
+    pixels[offset:offset + span, offset:offset + span] = modules[:span, :span]
+
+    return pixels
+
+
+def _palette(foreground_color, background_color) -> list[int]:
+    foreground = ImageColor.getrgb(foreground_color) if isinstance(foreground_color, str) else tuple(foreground_color)
+    background = ImageColor.getrgb(background_color) if isinstance(background_color, str) else tuple(background_color)
+
+    return list(background[:3]) + list(foreground[:3])
+
+
+# render the matrix with a quiet zone as a 1-bit image (black on white) or a 2 colour palette image
+def render_image(matrix, pixel_size: int = 10, border: int = 4, foreground_color=(0, 0, 0),
+                 background_color=(255, 255, 255), shape: str = 'square', extent: int | None = None) -> Image.Image:
+    pixels = _render_pixels(matrix, pixel_size, border, shape, extent)
+    palette = _palette(foreground_color, background_color)
+    if palette == [255, 255, 255, 0, 0, 0]:
+        return Image.fromarray(~pixels)
+    img = Image.frombytes("P", pixels.shape[::-1], pixels.astype(np.uint8).tobytes())
+    img.putpalette(palette)
+
+    return img
+
+
+# palette images of equally sized matrices that all use the same 2 colour palette
+# (index 0 background, 1 foreground), ready to be written as animation frames
+def render_frames(matrices, pixel_size: int = 10, border: int = 4, foreground_color=(0, 0, 0),
+                  background_color=(255, 255, 255), shape: str = 'square') -> list[Image.Image]:
+    palette = _palette(foreground_color, background_color)
+    frames = []
+    for matrix in matrices:
+        pixels = _render_pixels(matrix, pixel_size, border, shape, None)
+        img = Image.frombytes("P", pixels.shape[::-1], pixels.astype(np.uint8).tobytes())
+        img.putpalette(palette)
+        frames.append(img)
+
+    return frames
+
+
+# black on white image straight from the packed rows of a QRMatrix, PIL reads the buffer
+# in place ("1;I" is packed bits with 1 as black) so nothing is unpacked
+def render_packed(matrix: QRMatrix, pixel_size: int = 10, border: int = 4) -> Image.Image:
+    img = Image.frombuffer("1", (matrix.size, matrix.size), matrix.packed, "raw", "1;I", 0, 1)
+    img = img.resize((matrix.size * pixel_size, matrix.size * pixel_size), Image.NEAREST)
+
+    return ImageOps.expand(img, border * pixel_size, fill=255)
+
 
 # save the QR matrix as a png
-def save_matrix_as_image(matrix: list[list[int]], filename: str, pixel_size: int = 10, border: int = 4):
-    size = len(matrix)
-    img_size = (size + 2*border) * pixel_size
-    img = Image.new("RGB", (img_size, img_size), "white")
-    pixels = img.load()
-
-    for r in range(size):
-        for c in range(size):
-            color = (0, 0, 0) if matrix[r][c] == 1 else (255, 255, 255)
-            for dy in range(pixel_size):
-                for dx in range(pixel_size):
-                    x = (c + border) * pixel_size + dx
-                    y = (r + border) * pixel_size + dy
-                    pixels[x, y] = color
+def save_matrix_as_image(matrix: list[list[int]] | QRMatrix, filename: str, pixel_size: int = 10, border: int = 4, show: bool = False):
+    # each module covers exactly pixel_size x pixel_size pixels, empty modules are white
+    if isinstance(matrix, QRMatrix):
+        img = render_packed(matrix, pixel_size, border)
+    else:
+        img = render_image(np.array(_module_masks(matrix)[0], dtype=np.uint8), pixel_size, border, extent=pixel_size)
 
     # save and display the image
     img.save(filename)
-    img.show()
\ No newline at end of file
+    if show:
+        img.show()
@@ -1,7 +1,8 @@
 # README:
-# Modular QR Code Generator V1-L and V2-L
+# Modular QR Code Generator, versions 1 to 40 at ECC levels L, M, Q and H
 #
-# This generates QR codes from a given text input. 
+# This generates QR codes from a given text input, split into numeric, alphanumeric,
+# byte and kanji mode segments so the bit stream (and so the version) is as small as possible.
 #
 # version 1-L QR code - Byte Mode           = Binary
 #                     - Byte mode indicator = '0100'
@@ -13,62 +14,58 @@
 #                     - Data bit capacity   = 34*8 = 272
 #                     - QR code size        = 25*25 modules
 #
+# version N-E         - Data codewords from encoding.DATA_CODEWORDS[E][N], split into
+#                       RS blocks and interleaved from version 3 onwards
+#                     - QR code size        = (4*N + 17)*(4*N + 17) modules
+#                     - Version information blocks from version 7 onwards
+#
 # Usage:
-#   python main.py "text" --version 1 --output qr.png
+#   python main.py "text" --version 1 --ecc M --output qr.png
+#   python main.py --batch input.jsonl --out-dir codes/
+#   python main.py --batch input.jsonl --store run.qrm
 #
 # Arguments:
 #   text: The text to put in the QR code.
-#   --version: 1 or 2, default is 1
-#   --output: The output file name, default is 'qr.png'
+#   --version: 1 to 40, default is the smallest that fits
+#   --ecc: error correction level L, M, Q or H, default is L
+#   --output: The output file name, default is 'qr.png', .svg and .pdf are written as vectors
+#   --batch: .txt (one text per line), .csv or .jsonl file to generate in bulk
+#   --out-dir: directory for batch output, default is 'qr_codes'
+#   --store: append batch output to a memory-mapped matrix store (store.py) instead of PNGs
+#   --workers: worker processes for batch mode, 0 uses every core
+#   --slideshow: also write every generation step as step<N>_<name>.png
+#   --animation: write every step as one animated .gif or .apng
+#   --show: open the PNG output in the default image viewer
+#   --verify: decode every generated code and fail if it does not read back as the input
+#   --metrics: print stage timings and counters in the Prometheus text format when done
 
 import argparse
+import sys
 
-from encoding import generate_codewords
-from matrix import initialise_matrix, place_data_bits
-from masking import apply_mask, calculate_penalty
-from image_utils import save_matrix_as_image
-
-# calculates the format information bit string
-def get_format_info_bits(ec_level: str, mask_pattern: int) -> str:
-    """
-    Calculates the format information bit string based on the error correction level and mask pattern.
-
-    Args:
-        ec_level: L, M, Q, or H
-        mask_pattern: 0 to 7
-
-    Returns:
-        A 15-bit string representing the format information.
-    """
-    # EC level bits
-    ec_bits_map = {'L': 0b01, 'M': 0b00, 'Q': 0b11, 'H': 0b10}
-    if ec_level not in ec_bits_map:
-        raise ValueError(f"Invalid error correction level: {ec_level}. Must be L, M, Q, or H.")
-    ec_bits = ec_bits_map[ec_level]
+from encoding import ECC_LEVELS, MAX_VERSION, MIN_VERSION, set_trace_hook, print_trace
+from pipeline import QRPipeline
+from slideshow import Slideshow
+from vector import hex_to_rgb, matrix_to_svg, matrix_to_pdf
+import metrics
 
-    # Combine EC bits and mask bits
-    fmt = (ec_bits << 3) | mask_pattern
+# PIL and batch mode are imported where they are first needed, the CLI is often run once
+# per code from shell pipelines and start up time dominates
 
-    poly = 0b10100110111  # Polynomial for format info
-    data = fmt << 10
-    # Polynomial division to calculate remainder
-    for i in range(14, 9, -1):
-        if (data >> i) & 1:
-            data ^= (poly << (i - 10))
 
-    # Append remainder and fixed mask 0b101010000010010
-    format_info = ((fmt << 10) | data) ^ 0b101010000010010
-
-    return format(format_info, '015b')
+# batch mode reports every record it could not generate
+def print_skipped(index: int, error: str) -> None:
+    print(f"Skipped record {index}: {error}")
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Generate QR codes with optional slideshow and customisation.")
-    parser.add_argument("text", help="Text to encode (byte mode).")
-    parser.add_argument("--version", "-v", type=int, choices=[1, 2], default=None, 
-                        help="QR code version (auto if not set).")
+    parser.add_argument("text", nargs="?", help="Text to encode.")
+    parser.add_argument("--version", "-v", type=int, choices=range(MIN_VERSION, MAX_VERSION + 1), default=None,
+                        metavar="{1..40}", help="QR code version (auto if not set).")
+    parser.add_argument("--ecc", "-e", choices=ECC_LEVELS, default="L",
+                        help="Error correction level.")
     parser.add_argument("--output", "-o", default="qr_output.png",
-                        help="Output PNG file name.")
+                        help="Output file name (.png, .svg or .pdf).")
     parser.add_argument("--foreground", "-fg", default="#000000",
                         help="Foreground colour in hex")
     parser.add_argument("--background", "-bg", default="#ffffff",
@@ -78,46 +75,91 @@ if __name__ == "__main__":
     parser.add_argument("--pixel", "-p", type=int, default=10,
                         help="Pixel size.")
     parser.add_argument("--slideshow", "-sl", action="store_true",
-                        help="Show step by step slideshow of QR code generation.")
+                        help="Write each step of QR code generation as a PNG.")
+    parser.add_argument("--animation", "-a", metavar="FILE",
+                        help="Write each step of QR code generation as one animated .gif or .apng.")
+    parser.add_argument("--show", action="store_true",
+                        help="Open the PNG output in the image viewer.")
+    parser.add_argument("--debug", "-d", action="store_true",
+                        help="Print the bit stream at each encoding step.")
+    parser.add_argument("--batch", "-b", metavar="FILE",
+                        help="Generate one code per record of a .txt, .csv or .jsonl file.")
+    parser.add_argument("--out-dir", default="qr_codes",
+                        help="Output directory for batch mode.")
+    parser.add_argument("--store", metavar="FILE",
+                        help="Append batch output to a matrix store file instead of writing PNGs.")
+    parser.add_argument("--chunk-size", type=int, default=None,
+                        help="Number of records generated together in batch mode (default 256).")
+    parser.add_argument("--workers", "-w", type=int, default=1,
+                        help="Worker processes for batch mode (0 uses every core).")
+    parser.add_argument("--verify", action="store_true",
+                        help="Decode every generated code and fail if it does not match the input.")
+    parser.add_argument("--metrics", action="store_true",
+                        help="Print stage timings and counters to stderr when done.")
     args = parser.parse_args()
-
-    raw = args.text.encode('iso-8859-1', 'strict')
-    if args.version is None:
-        # auto detect version based on input length
-        if len(raw) <= 19:
-            version = 1
-        elif len(raw) <= 34:
-            version = 2
-        else:
-            raise ValueError("Input too long (max 34 bytes for version 2).")
-    else:
-        version = args.version
-
-    # generate data and ECC codewords
-    data_codewords, ecc_codewords = generate_codewords(args.text, version)
-    bits = ''.join(format(b, '08b') for b in data_codewords + ecc_codewords)
-
-    matrix, reserved = initialise_matrix(version)
-    if args.slideshow:
-        save_matrix_as_image(matrix, f"step0_patterns.png", args.pixel)
-    place_data_bits(matrix, reserved, bits)
-    if args.slideshow:
-        save_matrix_as_image(matrix, f"step1_data_bits,png", args.pixel)
-
-    best = min(
-        ((mask, apply_mask(matrix, reserved, mask), calculate_penalty(apply_mask(matrix, reserved, mask)))
-         for mask in range(8)), key=lambda x: x[2]
-    )
-    mask, matrix, _ = best
+    if args.debug:
+        set_trace_hook(print_trace)
+    metrics.enable(args.metrics)
+
+    if args.store and not args.batch:
+        parser.error("--store is only used with --batch")
+    if args.workers < 0:
+        parser.error("--workers must be 0 or more")
+    if args.batch and args.store:
+        from batch import store_batch, DEFAULT_CHUNK_SIZE
+        written, failed = store_batch(args.batch, args.store, args.chunk_size or DEFAULT_CHUNK_SIZE,
+                                      args.workers, args.ecc, args.verify, print_skipped)
+        print(f"{written} QR codes added to {args.store} ({failed} skipped).")
+        raise SystemExit(1 if failed else 0)
+    if args.batch:
+        from batch import write_batch, DEFAULT_CHUNK_SIZE
+        written, failed = write_batch(args.batch, args.out_dir, args.pixel, args.chunk_size or DEFAULT_CHUNK_SIZE,
+                                      args.workers, args.ecc, args.verify, print_skipped)
+        print(f"{written} QR codes saved to {args.out_dir} ({failed} skipped).")
+        raise SystemExit(1 if failed else 0)
+    if args.text is None:
+        parser.error("text is required unless --batch is given")
+
+    out_format = args.output.lower().rsplit('.', 1)[-1]
+    animation_format = args.animation.lower().rsplit('.', 1)[-1] if args.animation else None
+    if animation_format not in (None, 'gif', 'apng', 'png'):
+        parser.error("--animation must be a .gif, .apng or .png file")
+    try:
+        foreground, background = hex_to_rgb(args.foreground), hex_to_rgb(args.background)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.slideshow or out_format not in ('svg', 'pdf'):
+        from image_utils import save_matrix_as_image
+
+    # packed snapshots of every step, only rendered once the code is done
+    slideshow = Slideshow() if args.slideshow or args.animation else None
+    pipeline = QRPipeline(args.ecc, snapshot=slideshow.capture if slideshow is not None else None)
+    code = pipeline.run(args.text, args.version)
+    version, mask, matrix = code.version, code.mask, code.matrix
+    if args.verify:
+        from decode import DecodeError, decode
+        try:
+            decoded = decode(matrix)
+        except DecodeError as e:
+            raise SystemExit(f"Verification failed: {e}")
+        if decoded.text != args.text:
+            raise SystemExit("Verification failed: decoded text differs from the input")
     if args.slideshow:
-        save_matrix_as_image(matrix, f"step2_mask_{mask}.png", args.pixel)
-
-    fmt = get_format_info_bits('L', mask)
-    fmt_positions = [(8, i) for i in range(6)] + [(8, 7), (8, 8), (7, 8)] + [(i, 8) for i in range(5, -1, -1)]
-    for idx, (r, c) in enumerate(fmt_positions):
-        matrix[r][c] = int(fmt[idx])
-    if args.slideshow:
-        save_matrix_as_image(matrix, f"step3_format.png", args.pixel)
-
-    save_matrix_as_image(matrix, args.output, args.pixel)
-    print(f"QR code saved to {args.output} (version {version}, mask {mask}).")
+        for number, (step, frame) in enumerate(zip(slideshow.steps, slideshow.frames)):
+            name = f"step{number}_{step}_{mask}.png" if step == 'mask' else f"step{number}_{step}.png"
+            save_matrix_as_image(frame, name, args.pixel)
+    if args.animation:
+        slideshow.save_animation(args.animation, 'gif' if animation_format == 'gif' else 'apng', args.pixel, 4,
+                                 foreground, background, args.shape)
+
+    with metrics.stage(f'render_{out_format}'):
+        if out_format in ('svg', 'pdf'):
+            render = matrix_to_svg if out_format == 'svg' else matrix_to_pdf
+            with open(args.output, 'wb') as f:
+                f.write(render(matrix, args.pixel, 4, foreground, background, args.shape))
+        else:
+            save_matrix_as_image(matrix, args.output, args.pixel, show=args.show)
+    metrics.IMAGES_RENDERED.inc(format=out_format, shape=args.shape)
+    print(f"QR code saved to {args.output} (version {version}-{args.ecc}, mask {mask}).")
+    if args.metrics:
+        sys.stderr.write(metrics.render_prometheus())
@@ -1,3 +1,10 @@
+import numpy as np
+from functools import lru_cache
+from typing import NamedTuple
+
+from format_info import FORMAT_BITS
+from matrix import as_module_array, get_format_index, get_template, place_format_bits
+
 # applies inversion if condition met, applies mask to qr matrix and returns new matrix
 def apply_mask(matrix: list[list[int]], reserved: list[list[bool]], mask_pattern: int) -> list[list[int]]:
     size = len(matrix)
@@ -20,6 +27,51 @@ def apply_mask(matrix: list[list[int]], reserved: list[list[bool]], mask_pattern
     return masked
 
 
+# boolean grid of every mask condition, stacked as (8, size, size) and cached per size
+@lru_cache(maxsize=None)
+def get_mask_grids(size: int) -> np.ndarray:
+    r, c = np.indices((size, size))
+    grids = np.stack([
+        (r + c) % 2 == 0,
+        (r % 2) == 0,
+        (c % 3) == 0,
+        ((r + c) % 3) == 0,
+        ((r // 2 + c // 3) % 2) == 0,
+        ((r * c) % 2 + (r * c) % 3) == 0,
+        (((r * c) % 2 + (r * c) % 3) % 2) == 0,
+        (((r + c) % 2 + (r * c) % 3) % 2) == 0,
+    ])
+    grids.setflags(write=False)
+
+    return grids
+
+
+# convert a matrix to uint8 modules and the maskable area (not reserved and not empty)
+def to_mask_arrays(matrix, reserved) -> tuple[np.ndarray, np.ndarray]:
+    reserved = np.asarray(reserved, dtype=bool)
+    matrix = as_module_array(matrix)
+    if isinstance(matrix, np.ndarray):
+        return matrix.astype(np.uint8, copy=False), ~reserved
+    modules = np.array([[0 if v is None else v for v in row] for row in matrix], dtype=np.uint8)
+    filled = np.array([[v is not None for v in row] for row in matrix], dtype=bool)
+
+    return modules, filled & ~reserved
+
+
+# applies all 8 masks in one pass, returns the masked stack (..., 8, size, size)
+# matches apply_mask for every mask, leading batch dimensions are broadcast
+# with an ECC level each candidate also gets the format information of its mask, so it
+# is scored exactly as it will be drawn
+def apply_masks(matrix, reserved, ecc: str | None = None) -> np.ndarray:
+    modules, maskable = to_mask_arrays(matrix, reserved)
+    grids = get_mask_grids(modules.shape[-1])
+    candidates = modules[..., None, :, :] ^ (grids & maskable[..., None, :, :])
+    if ecc is not None:
+        place_format_bits(candidates, FORMAT_BITS[ecc])
+
+    return candidates
+
+
 # calculates the score for each mask rule
 # count consecutive modules in rows and columns of the same colour
 def penalty_rule1(matrix: list[list[int]]) -> int:
@@ -120,4 +172,221 @@ def calculate_penalty(matrix: list[list[int]]) -> int:
     return (penalty_rule1(matrix) +
             penalty_rule2(matrix) +
             penalty_rule3(matrix) +
-            penalty_rule4(matrix))
\ No newline at end of file
+            penalty_rule4(matrix))
+
+# batched scoring: candidates is a uint8 stack (..., size, size), one penalty per matrix
+# rule 1 penalty of every line along the last axis, run lengths come from the diff of each line
+def _run_penalties(lines: np.ndarray) -> np.ndarray:
+    n = lines.shape[-1]
+    flat = lines.reshape(-1, n)
+    edges = np.ones((flat.shape[0], n + 1), dtype=bool)
+    edges[:, 1:-1] = flat[:, 1:] != flat[:, :-1]
+    line, pos = np.nonzero(edges)
+    lengths = np.diff(pos)
+    same_line = line[1:] == line[:-1]
+    scores = np.where(same_line & (lengths >= 5), lengths - 2, 0)
+    per_line = np.bincount(line[1:], weights=scores, minlength=flat.shape[0])
+
+    return per_line.reshape(lines.shape[:-1]).sum(axis=-1).astype(np.int64)
+
+
+# consecutive modules of the same colour in rows and columns
+def penalty_rule1_batch(candidates: np.ndarray) -> np.ndarray:
+
+    return _run_penalties(candidates) + _run_penalties(np.swapaxes(candidates, -1, -2))
+
+
+# 2x2 blocks of the same colour from sliced comparisons
+def penalty_rule2_batch(candidates: np.ndarray) -> np.ndarray:
+    top_left = candidates[..., :-1, :-1]
+    blocks = ((top_left == candidates[..., :-1, 1:])
+              & (top_left == candidates[..., 1:, :-1])
+              & (top_left == candidates[..., 1:, 1:]))
+
+    return 3 * blocks.sum(axis=(-2, -1), dtype=np.int64)
+
+
+# finder-like pattern with 4 light modules before or after, each window is correlated
+# against powers of two so a whole 11 module window becomes one integer
+_FINDER_WINDOWS = np.array([[0,0,0,0,1,0,1,1,1,0,1], [1,0,1,1,1,0,1,0,0,0,0]], dtype=np.int64)
+_WINDOW_WEIGHTS = 1 << np.arange(11, dtype=np.int64)
+_FINDER_CODES = _FINDER_WINDOWS @ _WINDOW_WEIGHTS
+
+
+# count windows matching a finder-like pattern in every line along the last axis
+def _finder_matches(lines: np.ndarray) -> np.ndarray:
+    windows = np.lib.stride_tricks.sliding_window_view(lines.astype(np.int64), 11, axis=-1)
+    codes = windows @ _WINDOW_WEIGHTS
+    hits = (codes == _FINDER_CODES[0]) | (codes == _FINDER_CODES[1])
+
+    return hits.sum(axis=(-2, -1), dtype=np.int64)
+
+
+# finder-like patterns in rows and columns
+def penalty_rule3_batch(candidates: np.ndarray) -> np.ndarray:
+
+    return 40 * (_finder_matches(candidates) + _finder_matches(np.swapaxes(candidates, -1, -2)))
+
+
+# deviation from 50% dark modules
+def penalty_rule4_batch(candidates: np.ndarray) -> np.ndarray:
+    total = candidates.shape[-1] * candidates.shape[-2]
+    dark = candidates.sum(axis=(-2, -1), dtype=np.int64)
+    prev = (dark * 20 // total) * 5
+    diff = np.minimum(np.abs(prev - 50), np.abs(prev + 5 - 50))
+
+    return (diff // 5) * 10
+
+
+# calculate total mask penalty of every matrix in the stack
+def calculate_penalties(candidates: np.ndarray) -> np.ndarray:
+
+    return (penalty_rule1_batch(candidates) +
+            penalty_rule2_batch(candidates) +
+            penalty_rule3_batch(candidates) +
+            penalty_rule4_batch(candidates))
+
+
+# incremental scoring: function patterns are identical in all 8 candidates, so the rows,
+# columns and 2x2 block rows without data modules score the same for each mask and are
+# counted once per version. Only the bands with data are scored, one rule at a time, and
+# a candidate is dropped as soon as its partial score shows it cannot beat the best
+# complete score. Candidates must carry the version's template (format area still empty)
+# as produced by initialise_arrays and apply_masks.
+
+# rule 1 over every line along the last axis: a run of n >= 5 scores n - 2, which is its
+# n - 4 windows of 5 equal modules plus 2 for the window that starts it
+def _run_scores(lines: np.ndarray) -> np.ndarray:
+    equal = lines[..., 1:] == lines[..., :-1]
+    five = equal[..., :-3] & equal[..., 1:-2] & equal[..., 2:-1] & equal[..., 3:]
+    starts = five[..., 0].sum(axis=-1, dtype=np.int64) + (five[..., 1:] & ~five[..., :-1]).sum(axis=(-2, -1), dtype=np.int64)
+
+    return five.sum(axis=(-2, -1), dtype=np.int64) + 2 * starts
+
+
+# rule 2 over 2x2 blocks whose top row is in lines
+def _block_scores(top: np.ndarray, bottom: np.ndarray) -> np.ndarray:
+    same = (top[..., :-1] == top[..., 1:]) & (top[..., :-1] == bottom[..., :-1]) & (top[..., :-1] == bottom[..., 1:])
+
+    return 3 * same.sum(axis=(-2, -1), dtype=np.int64)
+
+
+# rule 3 over every line along the last axis: 1011101 with 4 light modules before or after
+def _finder_scores(lines: np.ndarray) -> np.ndarray:
+    x, n = lines, lines.shape[-1]
+    core = x[..., :n-6] & ~x[..., 1:n-5] & x[..., 2:n-4] & x[..., 3:n-3] & x[..., 4:n-2] & ~x[..., 5:n-1] & x[..., 6:]
+    light = ~(x[..., :n-3] | x[..., 1:n-2] | x[..., 2:n-1] | x[..., 3:])
+    hits = (core[..., 4:] & light[..., :n-10]).sum(axis=(-2, -1), dtype=np.int64)
+    hits += (core[..., :n-10] & light[..., 7:]).sum(axis=(-2, -1), dtype=np.int64)
+
+    return 40 * hits
+
+
+# [start, stop) ranges of the True entries
+def _bands(flags: np.ndarray) -> tuple[tuple[int, int], ...]:
+    edges = np.flatnonzero(np.diff(np.concatenate([[0], flags.astype(np.int8), [0]])))
+
+    return tuple((int(start), int(stop)) for start, stop in zip(edges[::2], edges[1::2]))
+
+
+class PenaltyPlan(NamedTuple):
+    fixed: int                              # penalty of every line and block row without data
+    row_bands: tuple[tuple[int, int], ...]  # rows with data modules
+    col_bands: tuple[tuple[int, int], ...]  # columns with data modules
+    block_bands: tuple[tuple[int, int], ...]  # top rows of 2x2 blocks touching data
+
+
+@lru_cache(maxsize=64)
+def get_penalty_plan(version: int) -> PenaltyPlan:
+    template, reserved = get_template(version)
+    modules = template.astype(bool)
+    # format cells differ between candidates when format information is placed before scoring
+    data = ~reserved
+    data[get_format_index(template.shape[-1])] = True
+    rows, cols = data.any(axis=1), data.any(axis=0)
+    block_rows = rows[:-1] | rows[1:]
+
+    fixed_rows, fixed_cols = modules[~rows], modules.T[~cols]
+    tops = np.flatnonzero(~block_rows)
+    fixed = (_run_scores(fixed_rows) + _run_scores(fixed_cols)
+             + _block_scores(modules[tops], modules[tops + 1])
+             + _finder_scores(fixed_rows) + _finder_scores(fixed_cols))
+
+    return PenaltyPlan(int(fixed), _bands(rows), _bands(cols), _bands(block_rows))
+
+
+# each stage scores the data bands of one rule for (K, size, size) boolean candidates
+def _stage_rule1(candidates: np.ndarray, plan: PenaltyPlan) -> np.ndarray:
+    columns = np.swapaxes(candidates, -1, -2)
+
+    return (sum(_run_scores(candidates[:, a:b]) for a, b in plan.row_bands)
+            + sum(_run_scores(columns[:, a:b]) for a, b in plan.col_bands))
+
+
+def _stage_rule2(candidates: np.ndarray, plan: PenaltyPlan) -> np.ndarray:
+
+    return sum(_block_scores(candidates[:, a:b], candidates[:, a+1:b+1]) for a, b in plan.block_bands)
+
+
+def _stage_rule3(candidates: np.ndarray, plan: PenaltyPlan) -> np.ndarray:
+    columns = np.swapaxes(candidates, -1, -2)
+
+    return (sum(_finder_scores(candidates[:, a:b]) for a, b in plan.row_bands)
+            + sum(_finder_scores(columns[:, a:b]) for a, b in plan.col_bands))
+
+
+def _stage_rule4(candidates: np.ndarray, plan: PenaltyPlan) -> np.ndarray:
+
+    return penalty_rule4_batch(candidates)
+
+
+# cheapest first, so the expensive rules run on fewer surviving candidates
+_STAGES = (_stage_rule4, _stage_rule2, _stage_rule1, _stage_rule3)
+
+# below this many modules per candidate set (8 candidates of every matrix) pruning costs
+# more bookkeeping than it saves and every stage is simply run on every candidate
+EARLY_EXIT_MODULES = 150_000
+
+
+# index of the lowest penalty mask for every matrix in a (..., 8, size, size) candidate stack
+# same result as calculate_penalties(candidates).argmin(axis=-1), ties go to the lower mask
+def best_masks(candidates: np.ndarray) -> np.ndarray:
+    size = candidates.shape[-1]
+    plan = get_penalty_plan((size - 17) // 4)
+    # 0/1 uint8 modules can be read as booleans without a copy
+    modules = candidates.view(bool) if candidates.dtype == np.uint8 else candidates.astype(bool)
+    stack = modules.reshape(-1, 8, size, size)
+    rows = np.arange(stack.shape[0])
+    mask_ids = np.arange(8)
+
+    first, *rest = _STAGES
+    partial = plan.fixed + first(stack.reshape(-1, size, size), plan).reshape(-1, 8)
+    if stack.shape[0] * size * size < EARLY_EXIT_MODULES:
+        for stage in rest:
+            partial += stage(stack.reshape(-1, size, size), plan).reshape(-1, 8)
+        return partial.argmin(axis=1).reshape(candidates.shape[:-3])
+
+    # fully score the most promising candidate of every matrix for an upper bound
+    best = partial.argmin(axis=1)
+    seeds = stack[rows, best]
+    bound = partial[rows, best] + sum(stage(seeds, plan) for stage in rest)
+
+    # penalties only grow, so a candidate whose partial score is already above the bound
+    # (or equal with a higher mask) can never be picked
+    def could_win(scores: np.ndarray) -> np.ndarray:
+        return (scores < bound[:, None]) | ((scores == bound[:, None]) & (mask_ids < best[:, None]))
+
+    alive = could_win(partial)
+    alive[rows, best] = False
+    for stage in rest:
+        items, masks = np.nonzero(alive)
+        if items.size == 0:
+            break
+        partial[items, masks] += stage(stack[items, masks], plan)
+        alive &= could_win(partial)
+
+    # survivors are complete and beat the bound
+    totals = np.where(alive, partial, np.iinfo(np.int64).max)
+    totals[rows, best] = bound
+
+    return totals.argmin(axis=1).reshape(candidates.shape[:-3])
@@ -1,3 +1,6 @@
+import numpy as np
+from functools import lru_cache
+
 from patterns import (
     generate_pattern_matrix,
     get_finder_pattern_positions,
@@ -6,18 +9,16 @@ from patterns import (
     add_separators,
     add_timing_pattern, 
     add_dark_module, 
+    add_version_info,
     reserve_format_info
 )
 
 # create empty QR matrix for given version with function patterns
 # calculates the size of qr code based on the version
 def initialise_matrix(version: int) -> tuple[list[list[int]], list[list[bool]]]:
-    if version == 1:
-        size = 21
-    elif version == 2:
-        size = 25
-    else:
+    if not 1 <= version <= 40:
         raise ValueError("Unsupported version")
+    size = 4 * version + 17
     
     # create blank matrix and reserved
     matrix = [[None]*size for _ in range(size)]
@@ -29,7 +30,7 @@ def initialise_matrix(version: int) -> tuple[list[list[int]], list[list[bool]]]:
     matrix, reserved = place_matrix_in_positions(matrix, finder_pattern_matrix, finder_pattern_positions, reserved)
     
 
-    # add alignment patterns (version 2)
+    # add alignment patterns (version 2 and up)
     alignment_pattern_matrix = generate_pattern_matrix(5, 1)
     alignment_pattern_positions = get_alignment_pattern_positions(version, size)
     matrix, reserved = place_matrix_in_positions(matrix, alignment_pattern_matrix, alignment_pattern_positions, reserved)
@@ -44,9 +45,31 @@ def initialise_matrix(version: int) -> tuple[list[list[int]], list[list[bool]]]:
     # reserve format information areas
     reserve_format_info(reserved)
 
+    # add version information (version 7 and up)
+    add_version_info(matrix, reserved, version)
+
     return matrix, reserved
 
 
+# function pattern matrix and reserved mask for a version, built once and kept read-only
+@lru_cache(maxsize=64)
+def get_template(version: int) -> tuple[np.ndarray, np.ndarray]:
+    matrix, reserved = initialise_matrix(version)
+    modules = np.array([[0 if v is None else v for v in row] for row in matrix], dtype=np.uint8)
+    reserved = np.array(reserved, dtype=bool)
+    modules.setflags(write=False)
+    reserved.setflags(write=False)
+
+    return modules, reserved
+
+
+# cheap per request copy of the cached template, the reserved mask is shared and read-only
+def initialise_arrays(version: int) -> tuple[np.ndarray, np.ndarray]:
+    modules, reserved = get_template(version)
+
+    return modules.copy(), reserved
+
+
 # applies data and ECC bits after all patterns and reservations applied
 def place_data_bits(matrix: list[list[int]], reserved: list[list[bool]], bitstream: str):
     size = len(matrix)
@@ -67,10 +90,184 @@ def place_data_bits(matrix: list[list[int]], reserved: list[list[bool]], bitstre
         direction *= -1
 
 
+# flat indices of the data modules in zig-zag placement order, cached per version
+@lru_cache(maxsize=64)
+def get_placement_index(version: int) -> np.ndarray:
+    _, reserved = get_template(version)
+    size = len(reserved)
+    order = []
+    direction = -1
+    col = size - 1
+    while col > 0:
+        if col == 6:
+            col -= 1  # skip vertical timing column
+        for i in range(size):
+            row = (size - 1 - i) if direction == -1 else i
+            for c in (col, col - 1):
+                if not reserved[row, c]:
+                    order.append(row * size + c)
+        col -= 2
+        direction *= -1
+    index = np.array(order, dtype=np.intp)
+    index.setflags(write=False)
+
+    return index
+
+
+# place codewords with a single fancy-index write of their unpacked bits
+# matrix may be a batch (..., size, size) with codewords (..., n) as a uint8 array
+def place_codewords(matrix: np.ndarray, codewords) -> None:
+    if not isinstance(codewords, np.ndarray):
+        codewords = np.frombuffer(bytes(codewords), dtype=np.uint8)
+    bits = np.unpackbits(codewords, axis=-1)
+    size = matrix.shape[-1]
+    index = get_placement_index((size - 17) // 4)
+    if bits.shape[-1] > index.size:
+        raise ValueError("Too many codewords for version")
+    flat = matrix.reshape(*matrix.shape[:-2], size * size)
+    flat[..., index[:bits.shape[-1]]] = bits
+
+
+# positions of both format information copies in bit order, the first around the top-left
+# finder and the second split between the bottom-left and top-right finders
+def get_format_positions(size: int) -> list[list[tuple[int, int]]]:
+    first = [(8, i) for i in range(6)] + [(8, 7), (8, 8), (7, 8)] + [(i, 8) for i in range(5, -1, -1)]
+    second = [(size-1 - i, 8) for i in range(7)] + [(8, size-8)] + [(8, size-7 + i) for i in range(7)]
+
+    return [first, second]
+
+
+# row and column index arrays of the 30 format cells, both copies in bit order
+@lru_cache(maxsize=64)
+def get_format_index(size: int) -> tuple[np.ndarray, np.ndarray]:
+    first, second = get_format_positions(size)
+    rows, cols = np.array(first + second, dtype=np.intp).T
+    rows.setflags(write=False)
+    cols.setflags(write=False)
+
+    return rows, cols
+
+
+# bit of the format word written to each of the 30 format cells
+FORMAT_BIT_ORDER = np.tile(np.arange(15), 2)
+
+
+# write 15 format bits into both copies with one indexed assignment, bits may be a string
+# or a (..., 15) array broadcast against the leading dimensions of the matrix
+def place_format_bits(matrix: np.ndarray, bits) -> None:
+    if isinstance(bits, str):
+        bits = np.frombuffer(bits.encode('ascii'), dtype=np.uint8) - ord('0')
+    rows, cols = get_format_index(matrix.shape[-1])
+    matrix[..., rows, cols] = np.asarray(bits)[..., FORMAT_BIT_ORDER]
+
+
 # complete QR matrix with all function patterns and data bits
 def create_full_matrix(version: int, data_bits: str, ecc_bits: str) -> tuple[list[list[int]], list[list[bool]]]:
     matrix, reserved = initialise_matrix(version)
     full_bits = data_bits + ecc_bits
     place_data_bits(matrix, reserved, full_bits)
 
-    return matrix, reserved
\ No newline at end of file
+    return matrix, reserved
+
+# QR matrix with modules packed 8 to a byte, each row padded to whole bytes (big-endian
+# bit order, so a row reads like np.packbits output and PIL "1;I" raw image data).
+# The reserved mask is the shared read-only template mask of the version.
+class QRMatrix:
+    __slots__ = ('version', 'size', 'packed')
+
+    def __init__(self, version: int, packed: np.ndarray | None = None):
+        self.version = version
+        self.size = 4 * version + 17
+        stride = (self.size + 7) // 8
+        if packed is None:
+            packed = np.zeros((self.size, stride), dtype=np.uint8)
+        elif packed.shape != (self.size, stride):
+            raise ValueError(f"Packed buffer shape {packed.shape} does not match version {version}")
+        self.packed = packed
+
+    # function patterns of a version with no data placed
+    @classmethod
+    def template(cls, version: int) -> 'QRMatrix':
+        return cls.from_array(get_template(version)[0], version)
+
+    @classmethod
+    def from_array(cls, modules, version: int | None = None) -> 'QRMatrix':
+        modules = np.asarray(modules, dtype=np.uint8)
+        version = (modules.shape[-1] - 17) // 4 if version is None else version
+
+        return cls(version, np.packbits(modules, axis=-1))
+
+    # legacy list matrix, empty (None) modules become light
+    @classmethod
+    def from_lists(cls, matrix: list[list[int | None]]) -> 'QRMatrix':
+        return cls.from_array([[0 if v is None else v for v in row] for row in matrix])
+
+    # wrap packed bytes without copying, the result is read-only for immutable buffers
+    @classmethod
+    def frombuffer(cls, buffer, version: int) -> 'QRMatrix':
+        size = 4 * version + 17
+        packed = np.frombuffer(buffer, dtype=np.uint8).reshape(size, (size + 7) // 8)
+
+        return cls(version, packed)
+
+    def tobytes(self) -> bytes:
+        return self.packed.tobytes()
+
+    @property
+    def reserved(self) -> np.ndarray:
+        return get_template(self.version)[1]
+
+    @property
+    def nbytes(self) -> int:
+        return self.packed.nbytes
+
+    # zero-copy packed view of rows start to stop, e.g. for streaming to an image encoder
+    def rows(self, start: int = 0, stop: int | None = None) -> np.ndarray:
+        view = self.packed[start:stop]
+        view.flags.writeable = False
+
+        return view
+
+    # unpacked (size, size) uint8 copy for the array based functions
+    def to_array(self) -> np.ndarray:
+        return np.unpackbits(self.packed, axis=-1, count=self.size)
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        modules = self.to_array()
+        return modules if dtype is None else modules.astype(dtype)
+
+    # list matrix for the legacy list based functions (apply_mask, penalty_rule1-4, ...)
+    def tolist(self) -> list[list[int]]:
+        return self.to_array().tolist()
+
+    # number of rows, like a list matrix
+    def __len__(self) -> int:
+        return self.size
+
+    def __getitem__(self, position: tuple[int, int]) -> int:
+        r, c = position
+        return (int(self.packed[r, c >> 3]) >> (7 - (c & 7))) & 1
+
+    def __setitem__(self, position: tuple[int, int], value: int) -> None:
+        r, c = position
+        bit = 1 << (7 - (c & 7))
+        if value:
+            self.packed[r, c >> 3] |= bit
+        else:
+            self.packed[r, c >> 3] &= ~bit & 0xFF
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, QRMatrix):
+            return NotImplemented
+        return self.version == other.version and np.array_equal(self.packed, other.packed)
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return f"QRMatrix(version={self.version}, size={self.size})"
+
+
+# modules of a matrix as an array: QRMatrix is unpacked, arrays pass through and lists
+# are returned as they are for the callers' own list handling
+def as_module_array(matrix):
+    return matrix.to_array() if isinstance(matrix, QRMatrix) else matrix
@@ -0,0 +1,187 @@
+# Pipeline instrumentation
+#
+# Stage latency histograms and counters, exported in the Prometheus text format.
+# Recording is off until enable() is called: stage() then returns a shared no-op context
+# and counter increments return straight away, so the hooks can stay in the pipeline.
+#
+# Usage:
+#   with metrics.stage('mask_search'):
+#       ...
+#   metrics.MASKS_SELECTED.inc(mask=3)
+#   body = metrics.render_prometheus()
+#
+# Values are per process, each worker of a pool keeps its own.
+
+import bisect
+import threading
+import time
+from contextlib import nullcontext
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# upper bounds in seconds, +Inf is implied
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+_enabled = False
+_DISABLED = nullcontext()
+
+
+def enable(flag: bool = True) -> None:
+    global _enabled
+    _enabled = flag
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _format_labels(names: tuple[str, ...], values: tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# counter keyed by label values, inc(**labels) is a no-op while recording is off
+class Counter:
+
+    def __init__(self, name: str, description: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        if not _enabled:
+            return
+        key = tuple(labels[name] for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(labels[name] for name in self.labels), 0)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._values.clear()
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_format_labels(self.labels, key)} {_format_value(value)}')
+
+        return lines
+
+
+# cumulative bucket histogram keyed by label values
+class Histogram:
+
+    def __init__(self, name: str, description: str, labels: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per bucket counts (last is +Inf), sum, count]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        if not _enabled:
+            return
+        key = tuple(labels[name] for name in self.labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def count(self, **labels) -> int:
+        series = self._series.get(tuple(labels[name] for name in self.labels))
+
+        return series[2] if series else 0
+
+    def clear(self) -> None:
+        with self._lock:
+            self._series.clear()
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+        bounds = [repr(b) for b in self.buckets] + ['+Inf']
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket in zip(bounds, counts):
+                    cumulative += bucket
+                    le = 'le="%s"' % bound
+                    lines.append(f'{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}')
+                lines.append(f'{self.name}_sum{_format_labels(self.labels, key)} {total!r}')
+                lines.append(f'{self.name}_count{_format_labels(self.labels, key)} {count}')
+
+        return lines
+
+
+STAGE_SECONDS = Histogram('qr_stage_seconds', 'Time spent in each pipeline stage.', ('stage',))
+CODES_GENERATED = Counter('qr_codes_generated_total', 'QR codes generated, by version and ECC level.', ('version', 'ecc'))
+MASKS_SELECTED = Counter('qr_mask_selected_total', 'Mask pattern picked by the penalty search.', ('mask',))
+IMAGES_RENDERED = Counter('qr_images_rendered_total', 'Images rendered, by format and module shape.', ('format', 'shape'))
+
+REGISTRY = [STAGE_SECONDS, CODES_GENERATED, MASKS_SELECTED, IMAGES_RENDERED]
+
+
+class _StageTimer:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        STAGE_SECONDS.observe(time.perf_counter() - self.start, stage=self.name)
+        return False
+
+
+# time the enclosed block as one observation of a stage
+def stage(name: str):
+    if not _enabled:
+        return _DISABLED
+
+    return _StageTimer(name)
+
+
+# code generated with the mask the search picked
+def record_code(version: int, ecc: str, mask: int) -> None:
+    if not _enabled:
+        return
+    CODES_GENERATED.inc(version=version, ecc=ecc)
+    MASKS_SELECTED.inc(mask=mask)
+
+
+def render_prometheus() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+
+    return '\n'.join(lines) + '\n'
+
+
+def reset() -> None:
+    for metric in REGISTRY:
+        metric.clear()
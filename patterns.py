@@ -36,15 +36,26 @@ def get_finder_pattern_positions(size: int) -> list[tuple[int,int]]:
     return [(0,0), (0, size - 7), (size - 7, 0)]
 
 
-# return top left corners 5x5
-def get_alignment_pattern_positions(version: int, size: int) -> list[tuple[int,int]]: 
+# centre row/column coordinates of the alignment patterns for a version
+def get_alignment_coordinates(version: int, size: int) -> list[int]:
     if version < 2:
         return []
-    coords = [6, size - 7]
+    count = version // 7 + 2
+    # spacing is even and equal except for the first gap, which absorbs the rest
+    step = (version * 8 + count * 3 + 5) // (count * 4 - 4) * 2
+
+    return [6] + [size - 7 - i * step for i in reversed(range(count - 1))]
+
+
+# return top left corners 5x5
+def get_alignment_pattern_positions(version: int, size: int) -> list[tuple[int,int]]: 
+    coords = get_alignment_coordinates(version, size)
+    last = size - 7
     positions = []
     for r in coords:
         for c in coords:
-            if (r == 6 and c == 6) or (r == 6 and c == size-7) or (r == size-7 and c == 6):
+            # skip the three corners covered by finder patterns
+            if (r == 6 and c == 6) or (r == 6 and c == last) or (r == last and c == 6):
                 continue
             positions.append((r - 2, c - 2))
     return positions
@@ -101,4 +112,20 @@ def reserve_format_info(reserved: list[list[bool]]):
         reserved[i][8] = True
     for i in range(8):
         reserved[8][size - 1 - i] = True
-        reserved[size - 1 - i][8] = True
\ No newline at end of file
+        reserved[size - 1 - i][8] = True
+
+
+# place the two 6x3 version information blocks (version 7 and up)
+def add_version_info(matrix: list[list[int]], reserved: list[list[bool]], version: int):
+    if version < 7:
+        return
+    from format_info import get_version_info_bits
+    size = len(matrix)
+    bits = get_version_info_bits(version)
+    for i in range(18):
+        bit = int(bits[17 - i])  # least significant bit first
+        a, b = size - 11 + i % 3, i // 3
+        matrix[a][b] = bit
+        matrix[b][a] = bit
+        reserved[a][b] = True
+        reserved[b][a] = True
@@ -0,0 +1,97 @@
+# Single code generation pipeline shared by the CLI and the web app
+#
+# Stages, each a method so callers can run or time them on their own:
+#   choose_version -> codewords -> place -> mask -> add_format
+# run() chains them and returns the final matrix bit-packed. A snapshot hook, when set,
+# is called after placement, data bits, masking and format info with the matrix as it is
+# at that step. Without a hook no copies are made.
+#
+# Usage:
+#   code = QRPipeline(ecc='M').run("Hello World")
+#   code.matrix, code.version, code.mask
+#
+#   steps = []
+#   QRPipeline(snapshot=lambda step, matrix: steps.append((step, matrix.copy()))).run(text)
+
+from typing import Callable, NamedTuple
+
+import numpy as np
+
+import metrics
+from encoding import choose_version, generate_codewords
+from format_info import FORMAT_BITS
+from masking import apply_masks, best_masks
+from matrix import QRMatrix, initialise_arrays, place_codewords, place_format_bits
+
+# snapshot step names, in the order they are taken
+STEPS = ('patterns', 'data_bits', 'mask', 'format')
+
+
+# a finished code
+class QRCode(NamedTuple):
+    version: int
+    ecc: str
+    mask: int
+    matrix: QRMatrix
+
+
+class QRPipeline:
+
+    # snapshot(step, matrix) gets the working array, copy it to keep it past the call
+    # score_format scores the mask candidates with their format information in place
+    def __init__(self, ecc: str = 'L', snapshot: Callable[[str, np.ndarray], None] | None = None,
+                 score_format: bool = False):
+        self.ecc = ecc
+        self.snapshot = snapshot
+        self.score_format = score_format
+
+    def choose_version(self, data: str) -> int:
+        return choose_version(data, self.ecc)
+
+    # interleaved data and ECC codewords
+    def codewords(self, data: str, version: int) -> bytes:
+        data_cw, ecc_cw = generate_codewords(data, version, self.ecc)
+
+        return data_cw + ecc_cw
+
+    # function patterns and data bits, returns the modules and the reserved mask
+    def place(self, version: int, codewords: bytes) -> tuple[np.ndarray, np.ndarray]:
+        modules, reserved = initialise_arrays(version)
+        if self.snapshot is not None:
+            self.snapshot('patterns', modules)
+        with metrics.stage('placement'):
+            place_codewords(modules, codewords)
+        if self.snapshot is not None:
+            self.snapshot('data_bits', modules)
+
+        return modules, reserved
+
+    # lowest penalty mask and the masked modules
+    def mask(self, modules: np.ndarray, reserved: np.ndarray) -> tuple[int, np.ndarray]:
+        with metrics.stage('mask_search'):
+            candidates = apply_masks(modules, reserved, self.ecc if self.score_format else None)
+            mask = int(best_masks(candidates))
+        if self.snapshot is not None:
+            self.snapshot('mask', candidates[mask])
+
+        return mask, candidates[mask]
+
+    # both format information copies, in place
+    def add_format(self, masked: np.ndarray, mask: int) -> np.ndarray:
+        with metrics.stage('format_info'):
+            place_format_bits(masked, FORMAT_BITS[self.ecc][mask])
+        if self.snapshot is not None:
+            self.snapshot('format', masked)
+
+        return masked
+
+    # every stage, version is chosen from the data unless given
+    def run(self, data: str, version: int | None = None) -> QRCode:
+        if version is None:
+            version = self.choose_version(data)
+        modules, reserved = self.place(version, self.codewords(data, version))
+        mask, masked = self.mask(modules, reserved)
+        matrix = QRMatrix.from_array(self.add_format(masked, mask), version)
+        metrics.record_code(version, self.ecc, mask)
+
+        return QRCode(version, self.ecc, mask, matrix)
@@ -0,0 +1,114 @@
+import numpy as np
+from functools import lru_cache
+
+# GF(256) arithmetic over the QR primitive polynomial x^8 + x^4 + x^3 + x^2 + 1
+PRIMITIVE = 0x11d
+
+
+# antilog (exp) and log tables, exp is doubled so exp[log a + log b] needs no modulo
+def _build_tables() -> tuple[list[int], list[int]]:
+    exp = [0] * 512
+    log = [0] * 256
+    x = 1
+    for i in range(255):
+        exp[i] = x
+        log[x] = i
+        x <<= 1
+        if x & 0x100:
+            x ^= PRIMITIVE
+    for i in range(255, 512):
+        exp[i] = exp[i - 255]
+
+    return exp, log
+
+
+EXP, LOG = _build_tables()
+
+
+# full multiplication table, MUL[a, b] is a * b in GF(256)
+def _build_mul_table() -> np.ndarray:
+    exp = np.array(EXP, dtype=np.uint8)
+    log = np.array(LOG, dtype=np.intp)
+    table = exp[log[:, None] + log[None, :]]
+    table[0, :] = 0
+    table[:, 0] = 0
+    table.setflags(write=False)
+
+    return table
+
+
+MUL = _build_mul_table()
+
+
+# multiply two field elements
+def gf_mul(a: int, b: int) -> int:
+    if a == 0 or b == 0:
+        return 0
+
+    return EXP[LOG[a] + LOG[b]]
+
+
+# generator polynomial (x - a^0)(x - a^1)...(x - a^(n-1)), highest degree first
+@lru_cache(maxsize=None)
+def generator_poly(ecc_count: int) -> tuple[int, ...]:
+    poly = [1]
+    for i in range(ecc_count):
+        term = EXP[i]
+        poly = [a ^ gf_mul(b, term) for a, b in zip(poly + [0], [0] + poly)]
+
+    return tuple(poly)
+
+
+# product of every field element with the generator terms, one row per feedback value
+@lru_cache(maxsize=None)
+def _generator_rows(ecc_count: int) -> np.ndarray:
+    gen = np.array(generator_poly(ecc_count)[1:], dtype=np.intp)
+    rows = MUL[:, gen]
+    rows.setflags(write=False)
+
+    return rows
+
+
+@lru_cache(maxsize=None)
+def _generator_lists(ecc_count: int) -> tuple[tuple[int, ...], ...]:
+
+    return tuple(tuple(row) for row in _generator_rows(ecc_count).tolist())
+
+
+# ECC codewords for a single message, table-driven polynomial division
+def rs_encode(data: bytes, ecc_count: int) -> bytes:
+    rows = _generator_lists(ecc_count)
+    remainder = [0] * ecc_count
+    for byte in data:
+        factor = byte ^ remainder[0]
+        remainder = [r ^ g for r, g in zip(remainder[1:] + [0], rows[factor])]
+
+    return bytes(remainder)
+
+
+# ECC codewords for N equal length blocks at once, blocks is an (N, k) uint8 array
+# returns an (N, ecc_count) uint8 array
+def rs_encode_blocks(blocks: np.ndarray, ecc_count: int) -> np.ndarray:
+    blocks = np.asarray(blocks, dtype=np.uint8)
+    rows = _generator_rows(ecc_count)
+    remainder = np.zeros((blocks.shape[0], ecc_count), dtype=np.uint8)
+    for i in range(blocks.shape[1]):
+        factor = blocks[:, i] ^ remainder[:, 0]
+        remainder[:, :-1] = remainder[:, 1:]
+        remainder[:, -1] = 0
+        remainder ^= rows[factor]
+
+    return remainder
+
+
+# syndromes of N equal length codeword blocks (data then ECC), an (N, n) uint8 array
+# returns (N, ecc_count), all zero exactly when every block is a valid codeword
+def rs_syndromes(blocks: np.ndarray, ecc_count: int) -> np.ndarray:
+    blocks = np.asarray(blocks, dtype=np.uint8)
+    roots = np.array(EXP[:ecc_count], dtype=np.intp)
+    syndromes = np.zeros((blocks.shape[0], ecc_count), dtype=np.uint8)
+    # Horner's rule at every root a^0 ... a^(ecc_count - 1) at once
+    for i in range(blocks.shape[1]):
+        syndromes = MUL[syndromes, roots] ^ blocks[:, i, None]
+
+    return syndromes
@@ -0,0 +1,216 @@
+# Mixed mode segmentation
+#
+# The input is split into numeric, alphanumeric, byte and kanji segments so the encoded
+# bit stream is as short as possible. Costs are kept in sixths of a bit (a numeric digit
+# is 10/3 bits, an alphanumeric character 11/2) and a dynamic programme over the input
+# tracks, for every mode, the cheapest encoding that ends in a segment of that mode.
+
+from functools import lru_cache
+from typing import NamedTuple
+
+MODES = ('numeric', 'alphanumeric', 'byte', 'kanji')
+MODE_INDICATORS = {'numeric': 0b0001, 'alphanumeric': 0b0010, 'byte': 0b0100, 'kanji': 0b1000}
+
+# character count field width per mode for versions 1-9, 10-26 and 27-40
+CHAR_COUNT_BITS = {
+    'numeric': (10, 12, 14),
+    'alphanumeric': (9, 11, 13),
+    'byte': (8, 16, 16),
+    'kanji': (8, 10, 12),
+}
+VERSION_GROUPS = ((1, 9), (10, 26), (27, 40))
+
+ALPHANUMERIC_CHARSET = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ $%*+-./:'
+_ALPHANUMERIC_VALUES = {ch: i for i, ch in enumerate(ALPHANUMERIC_CHARSET)}
+
+# cost of one character in sixths of a bit
+_CHAR_COSTS = (20, 33, 48, 78)
+_INFINITY = float('inf')
+
+
+# a run of characters encoded in one mode
+class Segment(NamedTuple):
+    mode: str
+    text: str
+
+
+def version_group(version: int) -> int:
+
+    return 0 if version <= 9 else 1 if version <= 26 else 2
+
+
+def char_count_bits(mode: str, version: int) -> int:
+
+    return CHAR_COUNT_BITS[mode][version_group(version)]
+
+
+# two byte Shift JIS value of a kanji mode character, or None
+def _kanji_value(ch: str) -> int | None:
+    try:
+        encoded = ch.encode('shift_jis')
+    except UnicodeEncodeError:
+        return None
+    if len(encoded) != 2:
+        return None
+    value = int.from_bytes(encoded, 'big')
+
+    return value if 0x8140 <= value <= 0x9FFC or 0xE040 <= value <= 0xEBBF else None
+
+
+# which modes can hold a character, in MODES order
+@lru_cache(maxsize=4096)
+def _char_modes(ch: str) -> tuple[bool, bool, bool, bool]:
+    latin1 = ord(ch) < 256
+
+    return ch.isascii() and ch.isdigit(), ch in _ALPHANUMERIC_VALUES, latin1, not latin1 and _kanji_value(ch) is not None
+
+
+# payload bits of a segment, excluding the mode indicator and character count
+def segment_data_bits(segment: Segment) -> int:
+    n = len(segment.text)
+    if segment.mode == 'numeric':
+        return n // 3 * 10 + (0, 4, 7)[n % 3]
+    if segment.mode == 'alphanumeric':
+        return n // 2 * 11 + n % 2 * 6
+    if segment.mode == 'byte':
+        return n * 8
+
+    return n * 13
+
+
+def segments_bit_length(segments: list[Segment], version: int) -> int:
+
+    return sum(4 + char_count_bits(s.mode, version) + segment_data_bits(s) for s in segments)
+
+
+# minimum bit segmentation of data for the character count widths of a version group
+# raises UnicodeEncodeError for characters that fit neither byte (ISO-8859-1) nor kanji mode
+@lru_cache(maxsize=1024)
+def _optimal_segments(data: str, group: int) -> tuple[Segment, ...]:
+    if not data:
+        return ()
+    head_costs = [(4 + CHAR_COUNT_BITS[mode][group]) * 6 for mode in MODES]
+    costs = head_costs[:]
+    # previous[i][j]: mode of character i on the cheapest path whose character i+1 is in mode j
+    previous = []
+    for i, ch in enumerate(data):
+        allowed = _char_modes(ch)
+        if not any(allowed):
+            raise UnicodeEncodeError('iso-8859-1', data, i, i + 1, "not encodable in byte or kanji mode")
+
+        # extend the current segment of every mode that can hold the character
+        current = [costs[j] + _CHAR_COSTS[j] if allowed[j] else _INFINITY for j in range(4)]
+        came_from = [j if allowed[j] else None for j in range(4)]
+        # or end it here, rounding up to whole bits, and start a new segment in mode j
+        ends = [(c + 5) // 6 * 6 if c != _INFINITY else c for c in current]
+        cheapest = min(range(4), key=ends.__getitem__)
+        for j in range(4):
+            switched = ends[cheapest] + head_costs[j]
+            if switched < current[j]:
+                current[j] = switched
+                came_from[j] = cheapest
+        previous.append(came_from)
+        costs = current
+
+    # walk back from the cheapest final mode
+    mode = min(range(4), key=lambda j: costs[j] if previous[-1][j] is not None else _INFINITY)
+    char_modes = [0] * len(data)
+    for i in range(len(data) - 1, -1, -1):
+        mode = previous[i][mode]
+        char_modes[i] = mode
+
+    segments = []
+    start = 0
+    for i in range(1, len(data) + 1):
+        if i == len(data) or char_modes[i] != char_modes[start]:
+            segments.append(Segment(MODES[char_modes[start]], data[start:i]))
+            start = i
+
+    return tuple(segments)
+
+
+# minimum bit segmentation of data for a version
+def make_segments(data: str, version: int) -> list[Segment]:
+
+    return list(_optimal_segments(data, version_group(version)))
+
+
+# append mode indicator, character count and payload of a segment to a bit buffer
+def append_segment(buffer, segment: Segment, version: int) -> None:
+    text = segment.text
+    buffer.append(MODE_INDICATORS[segment.mode], 4)
+    buffer.append(len(text), char_count_bits(segment.mode, version))
+    if segment.mode == 'numeric':
+        # groups of 3 digits in 10 bits, a trailing 2 or 1 digits in 7 or 4
+        for i in range(0, len(text), 3):
+            chunk = text[i:i+3]
+            buffer.append(int(chunk), len(chunk) * 3 + 1)
+    elif segment.mode == 'alphanumeric':
+        # pairs as 45 * first + second in 11 bits, a trailing character in 6
+        for i in range(0, len(text) - 1, 2):
+            buffer.append(_ALPHANUMERIC_VALUES[text[i]] * 45 + _ALPHANUMERIC_VALUES[text[i+1]], 11)
+        if len(text) % 2:
+            buffer.append(_ALPHANUMERIC_VALUES[text[-1]], 6)
+    elif segment.mode == 'byte':
+        buffer.append(int.from_bytes(text.encode('iso-8859-1'), 'big'), 8 * len(text))
+    else:
+        # Shift JIS value less 0x8140 or 0xC140, then high byte * 0xC0 + low byte in 13 bits
+        for ch in text:
+            value = _kanji_value(ch)
+            value -= 0x8140 if value <= 0x9FFC else 0xC140
+            buffer.append((value >> 8) * 0xC0 + (value & 0xFF), 13)
+
+
+_MODES_BY_INDICATOR = {indicator: mode for mode, indicator in MODE_INDICATORS.items()}
+
+
+# segments of a data codeword stream, up to the terminator or the end of the data
+# inverse of append_segment, raises ValueError for a stream no encoder would produce
+def parse_segments(data: bytes, version: int) -> list[Segment]:
+    value, total = int.from_bytes(data, 'big'), 8 * len(data)
+    position = 0
+
+    def read(length: int) -> int:
+        nonlocal position
+        if position + length > total:
+            raise ValueError("Segment runs past the end of the data codewords")
+        position += length
+        return (value >> (total - position)) & ((1 << length) - 1)
+
+    segments = []
+    while total - position >= 4:
+        indicator = read(4)
+        if indicator == 0:
+            break
+        mode = _MODES_BY_INDICATOR.get(indicator)
+        if mode is None:
+            raise ValueError(f"Unsupported mode indicator {indicator:04b}")
+        count = read(char_count_bits(mode, version))
+        if mode == 'numeric':
+            digits = []
+            for i in range(0, count, 3):
+                width = min(3, count - i)
+                digits.append(f'{read(width * 3 + 1):0{width}d}')
+            text = ''.join(digits)
+        elif mode == 'alphanumeric':
+            chars = []
+            for _ in range(count // 2):
+                pair = read(11)
+                chars += ALPHANUMERIC_CHARSET[pair // 45], ALPHANUMERIC_CHARSET[pair % 45]
+            if count % 2:
+                chars.append(ALPHANUMERIC_CHARSET[read(6)])
+            text = ''.join(chars)
+        elif mode == 'byte':
+            text = read(8 * count).to_bytes(count, 'big').decode('iso-8859-1')
+        else:
+            chars = []
+            for _ in range(count):
+                # undo high byte * 0xC0 + low byte, then add back 0x8140 or 0xC140
+                packed = read(13)
+                code = (packed // 0xC0 << 8) | (packed % 0xC0)
+                code += 0x8140 if code < 0x1F00 else 0xC140
+                chars.append(code.to_bytes(2, 'big').decode('shift_jis'))
+            text = ''.join(chars)
+        segments.append(Segment(mode, text))
+
+    return segments
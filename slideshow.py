@@ -0,0 +1,72 @@
+# Step by step slideshow of the generation pipeline
+#
+# The pipeline snapshot hook stores every step bit-packed (a QRMatrix, size * size / 8
+# bytes) and nothing is rendered until a frame is asked for. Frames of one code share
+# their size and palette, so an animation is written in a single pass.
+#
+# Usage:
+#   slideshow, code = Slideshow.record("Hello World", ecc='M')
+#   slideshow.render(2).save("step2.png")
+#   slideshow.save_animation("steps.gif")
+
+from matrix import QRMatrix
+from pipeline import STEPS, QRCode, QRPipeline
+
+# animation containers, the APNG is written by PIL's PNG plugin
+ANIMATION_FORMATS = {'gif': 'GIF', 'apng': 'PNG'}
+FRAME_DURATION_MS = 800
+
+
+class Slideshow:
+    __slots__ = ('steps', 'frames')
+
+    def __init__(self, steps: list[str] | None = None, frames: list[QRMatrix] | None = None):
+        self.steps = steps if steps is not None else []
+        self.frames = frames if frames is not None else []
+
+    # pipeline snapshot hook
+    def capture(self, step: str, matrix) -> None:
+        self.steps.append(step)
+        self.frames.append(QRMatrix.from_array(matrix))
+
+    # run the pipeline once, capturing every step
+    @classmethod
+    def record(cls, data: str, version: int | None = None, ecc: str = 'L') -> tuple['Slideshow', QRCode]:
+        slideshow = cls()
+        code = QRPipeline(ecc, snapshot=slideshow.capture).run(data, version)
+
+        return slideshow, code
+
+    # the packed frames back to back, in STEPS order
+    def tobytes(self) -> bytes:
+        return b''.join(frame.tobytes() for frame in self.frames)
+
+    # wrap the output of tobytes() without copying
+    @classmethod
+    def frombuffer(cls, buffer, version: int) -> 'Slideshow':
+        buffer = memoryview(buffer)
+        step_bytes = len(buffer) // len(STEPS)
+        frames = [QRMatrix.frombuffer(buffer[i * step_bytes:(i + 1) * step_bytes], version)
+                  for i in range(len(STEPS))]
+
+        return cls(list(STEPS), frames)
+
+    def __len__(self) -> int:
+        return len(self.frames)
+
+    # one step as an image, PIL is loaded on the first call
+    def render(self, index: int, pixel_size: int = 10, border: int = 4, foreground_color=(0, 0, 0),
+               background_color=(255, 255, 255), shape: str = 'square'):
+        from image_utils import render_image
+
+        return render_image(self.frames[index], pixel_size, border, foreground_color, background_color, shape)
+
+    # every step as one looping GIF or APNG, fmt is a key of ANIMATION_FORMATS
+    def save_animation(self, fp, fmt: str = 'gif', pixel_size: int = 10, border: int = 4,
+                       foreground_color=(0, 0, 0), background_color=(255, 255, 255), shape: str = 'square',
+                       duration: int = FRAME_DURATION_MS) -> None:
+        from image_utils import render_frames
+
+        first, *rest = render_frames(self.frames, pixel_size, border, foreground_color, background_color, shape)
+        first.save(fp, format=ANIMATION_FORMATS[fmt], save_all=True, append_images=rest,
+                   duration=duration, loop=0)
@@ -0,0 +1,204 @@
+# Memory-mapped store of generated matrices
+#
+# A print run is generated once and written here bit-packed with the version, ECC level
+# and mask of every code. Any number of renderers then map the file and render at their
+# own pixel size and colours without encoding or mask selection again. Matrices are
+# read-only views of the mapping, nothing is copied or unpacked until it is rendered.
+#
+# File layout, little endian:
+#   header   HEADER, magic, format, record count and offset of the last index segment
+#   then one block per append:
+#   records  packed QRMatrix rows back to back, a version v record is always
+#            (4v + 17) * ((4v + 24) // 8) bytes so the stride follows from the version
+#   segment  SEGMENT, offset of the previous segment (0 for the first) and row count,
+#            then one INDEX_DTYPE row per record of the append: payload hash, offset,
+#            version, ECC level, mask
+#
+# Nothing that is written is ever overwritten except the header. An append writes its
+# records and index segment after the end of the file, syncs them and only then points
+# the header at the new segment, so every committed state stays readable: a reader
+# opening the file mid-append, or after a crash, sees the store as of the last complete
+# append. Index segments only hold the new rows, so appending many small chunks leaves
+# no dead space.
+#
+# Usage:
+#   with MatrixStore("run.qrm", 'a') as store:
+#       store.append("Hello World", QRPipeline('M').run("Hello World"))
+#   store = MatrixStore("run.qrm")
+#   render_packed(store.get("Hello World", 'M').matrix, pixel_size=20)
+#   store[0].matrix, len(store)
+
+import hashlib
+import os
+import struct
+from typing import Iterable, Iterator
+
+import numpy as np
+
+from encoding import ECC_LEVELS
+from matrix import QRMatrix
+from pipeline import QRCode
+
+MAGIC = b'QRMS'
+FORMAT = 2
+HEADER = struct.Struct('<4sH2xQQ8x')
+SEGMENT = struct.Struct('<QQ')
+
+INDEX_DTYPE = np.dtype({'names': ['hash', 'offset', 'version', 'ecc', 'mask'],
+                        'formats': ['V16', '<u8', 'u1', 'u1', 'u1'],
+                        'offsets': [0, 16, 24, 25, 26], 'itemsize': 32})
+
+
+# lookup key of a payload, the version is left out since it follows from text and level
+def payload_hash(text: str, ecc: str = 'L') -> bytes:
+    return hashlib.sha256(ecc.encode('ascii') + b'\0' + text.encode('utf-8')).digest()[:16]
+
+
+def _record_bytes(version: int) -> int:
+    size = 4 * version + 17
+
+    return size * ((size + 7) // 8)
+
+
+class MatrixStore:
+
+    # mode 'r' reads, 'a' also appends and creates the file if it does not exist
+    def __init__(self, path: str, mode: str = 'r'):
+        if mode not in ('r', 'a'):
+            raise ValueError(f"Invalid mode {mode!r}, must be 'r' or 'a'")
+        if mode == 'a' and not os.path.exists(path):
+            with open(path, 'wb') as f:
+                f.write(HEADER.pack(MAGIC, FORMAT, 0, 0))
+        self.path = path
+        self.mode = mode
+        self._file = open(path, 'rb' if mode == 'r' else 'r+b')
+        self._positions = None
+        self._load()
+
+    def _load(self) -> None:
+        self._file.seek(0)
+        magic, fmt, count, self._last_segment = HEADER.unpack(self._file.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError(f"{self.path} is not a matrix store")
+        if fmt != FORMAT:
+            raise ValueError(f"Unsupported matrix store format {fmt}")
+        self._map()
+
+        # walk the segments from the last one back, filling the index from its end
+        self.index = np.empty(count, dtype=INDEX_DTYPE)
+        end, segment = count, self._last_segment
+        while segment:
+            start = segment + SEGMENT.size
+            if start > len(self._data):
+                raise ValueError(f"{self.path} is corrupt, an index segment is past the end of the file")
+            previous, rows = SEGMENT.unpack(self._data[segment:start].tobytes())
+            if rows > end or start + rows * INDEX_DTYPE.itemsize > len(self._data):
+                raise ValueError(f"{self.path} is corrupt, an index segment is past the end of the file")
+            self.index[end - rows:end] = self._data[start:start + rows * INDEX_DTYPE.itemsize].view(INDEX_DTYPE)
+            end, segment = end - rows, previous
+        if end:
+            raise ValueError(f"{self.path} is corrupt, its index is missing {end} records")
+        self._index_buffer = self.index
+        self._positions = None
+
+    # map the whole file again, after an append grew it
+    def _map(self) -> None:
+        self._data = np.memmap(self._file, dtype=np.uint8, mode='r')
+
+    # add rows to the end of the index, the buffer doubles when full so appends stay
+    # amortised O(new rows) however large the store gets
+    def _grow_index(self, rows: np.ndarray) -> None:
+        count = len(self.index) + len(rows)
+        if count > len(self._index_buffer):
+            buffer = np.empty(max(count, 2 * len(self._index_buffer)), dtype=INDEX_DTYPE)
+            buffer[:len(self.index)] = self.index
+            self._index_buffer = buffer
+        self._index_buffer[len(self.index):count] = rows
+        self.index = self._index_buffer[:count]
+
+    # payload hash -> record number, built on the first lookup
+    def _lookup(self) -> dict[bytes, int]:
+        if self._positions is None:
+            self._positions = {key.tobytes(): i for i, key in enumerate(self.index['hash'])}
+
+        return self._positions
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    # record number i, the matrix is a read-only view of the mapped file
+    def __getitem__(self, i: int) -> QRCode:
+        row = self.index[i]
+        offset, version, ecc, mask = int(row['offset']), int(row['version']), int(row['ecc']), int(row['mask'])
+        matrix = QRMatrix.frombuffer(self._data[offset:offset + _record_bytes(version)], version)
+
+        return QRCode(version, ECC_LEVELS[ecc], mask, matrix)
+
+    def __iter__(self) -> Iterator[QRCode]:
+        for i in range(len(self)):
+            yield self[i]
+
+    # the stored code of a payload, or None if it was never added
+    def get(self, text: str, ecc: str = 'L') -> QRCode | None:
+        i = self._lookup().get(payload_hash(text, ecc))
+
+        return None if i is None else self[i]
+
+    def __contains__(self, payload: tuple[str, str]) -> bool:
+        return payload_hash(*payload) in self._lookup()
+
+    # add (text, code) pairs in one write, payloads already stored are skipped
+    # returns the number of records added
+    def extend(self, items: Iterable[tuple[str, QRCode]]) -> int:
+        if self.mode != 'a':
+            raise ValueError(f"{self.path} is open read-only")
+        positions = self._lookup()
+        added, rows, payloads = {}, [], []
+        # anything past the last complete append is never referenced, so writing after the
+        # end of the file leaves the last committed state intact
+        offset = self._file.seek(0, os.SEEK_END)
+        for text, code in items:
+            key = payload_hash(text, code.ecc)
+            if key in positions or key in added:
+                continue
+            added[key] = len(self.index) + len(rows)
+            rows.append((key, offset, code.version, ECC_LEVELS.index(code.ecc), code.mask))
+            payloads.append(np.ascontiguousarray(code.matrix.packed))
+            offset += payloads[-1].nbytes
+        if not rows:
+            return 0
+
+        rows = np.array(rows, dtype=INDEX_DTYPE)
+        for packed in payloads:
+            self._file.write(packed)
+        self._file.write(SEGMENT.pack(self._last_segment, len(rows)))
+        self._file.write(rows.tobytes())
+        self._sync()
+        self._file.seek(0)
+        self._file.write(HEADER.pack(MAGIC, FORMAT, len(self.index) + len(rows), offset))
+        self._sync()
+
+        # the file is committed, bring this handle up to date without reading the index again
+        self._last_segment = offset
+        self._grow_index(rows)
+        positions.update(added)
+        self._map()
+
+        return len(rows)
+
+    def _sync(self) -> None:
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def append(self, text: str, code: QRCode) -> bool:
+        return self.extend([(text, code)]) == 1
+
+    def close(self) -> None:
+        self._data = None
+        self._file.close()
+
+    def __enter__(self) -> 'MatrixStore':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
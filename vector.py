@@ -0,0 +1,143 @@
+# Vector output (SVG and PDF) for QR matrices
+#
+# Sizes are given in the same units as the raster renderers: pixel_size per module
+# (SVG user units, PDF points) and a quiet zone of border modules. Drawing happens in
+# module units, squares as one rectangle per horizontal run of dark modules and circles
+# as references to a single shared shape, so output grows with the number of runs
+# rather than the number of modules.
+
+import numpy as np
+
+from matrix import as_module_array
+
+# control point distance for drawing a quarter circle with one cubic Bezier curve
+_KAPPA = 0.5522847498
+
+
+# "#rrggbb" or "rrggbb" to an (r, g, b) tuple, without loading PIL's ImageColor
+def hex_to_rgb(colour: str) -> tuple[int, int, int]:
+    colour = colour.lstrip('#')
+    if len(colour) != 6:
+        raise ValueError(f"Invalid colour: {colour}")
+    return tuple(int(colour[i:i+2], 16) for i in (0, 2, 4))
+
+
+def _dark_array(matrix) -> np.ndarray:
+    matrix = as_module_array(matrix)
+    if isinstance(matrix, np.ndarray):
+        return matrix == 1
+
+    return np.array([[v == 1 for v in row] for row in matrix], dtype=bool)
+
+
+# row, start column and length of every horizontal run of dark modules, in row-major order
+def _dark_runs(matrix) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    edges = np.diff(np.pad(_dark_array(matrix), ((0, 0), (1, 1))).astype(np.int8), axis=1)
+    rows, starts = np.nonzero(edges == 1)
+    _, ends = np.nonzero(edges == -1)
+
+    return rows, starts, ends - starts
+
+
+def _hex(colour) -> str:
+    return '#%02x%02x%02x' % tuple(colour[:3])
+
+
+# SVG document with the dark modules as one path, or one <use> of a shared circle each
+def matrix_to_svg(matrix, pixel_size: int = 10, border: int = 4, foreground_color=(0, 0, 0),
+                  background_color=(255, 255, 255), shape: str = 'square') -> bytes:
+    modules = len(matrix) + 2*border
+    img_size = modules * pixel_size
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{img_size}" height="{img_size}" viewBox="0 0 {modules} {modules}" shape-rendering="crispEdges">',
+        f'<rect width="100%" height="100%" fill="{_hex(background_color)}"/>',
+    ]
+    rows, starts, lengths = _dark_runs(matrix)
+    if shape == 'circle':
+        # without a viewBox the symbol is drawn unscaled at the <use> position
+        parts.append('<defs><symbol id="m" overflow="visible"><circle cx=".5" cy=".5" r=".5"/></symbol></defs>')
+        parts.append(f'<g fill="{_hex(foreground_color)}">')
+        for r, c, n in zip(rows.tolist(), starts.tolist(), lengths.tolist()):
+            y = r + border
+            parts.extend(f'<use href="#m" x="{x}" y="{y}"/>'
+                         for x in range(c + border, c + border + n))
+        parts.append('</g>')
+    else:
+        path = ''.join(f'M{c + border} {r + border}h{n}v1h-{n}z'
+                       for r, c, n in zip(rows.tolist(), starts.tolist(), lengths.tolist()))
+        parts.append(f'<path fill="{_hex(foreground_color)}" d="{path}"/>')
+    parts.append('</svg>')
+
+    return '\n'.join(parts).encode('utf-8')
+
+
+# path operators for a circle in the square at (x, y)
+def _pdf_circle(x: float, y: float, size: float) -> str:
+    r = size / 2
+    cx, cy = x + r, y + r
+    k = r * _KAPPA
+    return (f'{cx + r:g} {cy:g} m '
+            f'{cx + r:g} {cy + k:g} {cx + k:g} {cy + r:g} {cx:g} {cy + r:g} c '
+            f'{cx - k:g} {cy + r:g} {cx - r:g} {cy + k:g} {cx - r:g} {cy:g} c '
+            f'{cx - r:g} {cy - k:g} {cx - k:g} {cy - r:g} {cx:g} {cy - r:g} c '
+            f'{cx + k:g} {cy - r:g} {cx + r:g} {cy - k:g} {cx + r:g} {cy:g} c h')
+
+
+def _pdf_stream(dictionary: str, content: bytes) -> bytes:
+    return f'<< {dictionary} /Length {len(content)} >>\nstream\n'.encode('ascii') + content + b'\nendstream'
+
+
+# assemble a single page PDF from its page content stream and optional form XObjects
+# (name -> content drawn in a 1 x 1 box), which the page can draw with "/name Do"
+def _pdf_document(page_size: int, content: bytes, forms: dict[str, bytes] | None = None) -> bytes:
+    forms = forms or {}
+    first_form = 5
+    xobjects = ' '.join(f'/{name} {first_form + i} 0 R' for i, name in enumerate(forms))
+    resources = f' /Resources << /XObject << {xobjects} >> >>' if forms else ''
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        b'<< /Type /Pages /Kids [3 0 R] /Count 1 >>',
+        f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {page_size} {page_size}]{resources} /Contents 4 0 R >>'.encode('ascii'),
+        _pdf_stream('', content),
+    ] + [_pdf_stream('/Type /XObject /Subtype /Form /BBox [0 0 1 1]', form) for form in forms.values()]
+    out = bytearray(b'%PDF-1.4\n')
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b'%d 0 obj\n' % number + body + b'\nendobj\n'
+    xref = len(out)
+    out += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+    for offset in offsets:
+        out += b'%010d 00000 n \n' % offset
+    out += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref)
+
+    return bytes(out)
+
+
+def _pdf_colour(colour) -> str:
+    return ' '.join(f'{v / 255:.4g}' for v in colour[:3])
+
+
+# PDF page with one rectangle per run of dark modules, or one placement of a shared circle
+# form per module, pixel_size is in points
+def matrix_to_pdf(matrix, pixel_size: int = 10, border: int = 4, foreground_color=(0, 0, 0),
+                  background_color=(255, 255, 255), shape: str = 'square') -> bytes:
+    page_size = (len(matrix) + 2*border) * pixel_size
+    # after the background, scale to module units with the y axis pointing down like rows
+    ops = [f'{_pdf_colour(background_color)} rg 0 0 {page_size} {page_size} re f',
+           f'{pixel_size} 0 0 {-pixel_size} 0 {page_size} cm',
+           f'{_pdf_colour(foreground_color)} rg']
+    rows, starts, lengths = _dark_runs(matrix)
+    forms = {}
+    if shape == 'circle':
+        forms['M'] = f'{_pdf_circle(0, 0, 1)} f'.encode('ascii')
+        for r, c, n in zip(rows.tolist(), starts.tolist(), lengths.tolist()):
+            y = r + border
+            ops.extend(f'q 1 0 0 1 {x} {y} cm /M Do Q'
+                       for x in range(c + border, c + border + n))
+    else:
+        ops.extend(f'{c + border} {r + border} {n} 1 re'
+                   for r, c, n in zip(rows.tolist(), starts.tolist(), lengths.tolist()))
+        ops.append('f')
+
+    return _pdf_document(page_size, '\n'.join(ops).encode('ascii'), forms)